@@ -1,10 +1,21 @@
 import os
+import sys
 import ast
 import json
 import dspy
 import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import List
 
+# The rewrite engine lives next to the solvers in sed-solver/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sed-solver"))
+from verifier import Verifier
+from corpus import open_corpus
+from response_cache import DEFAULT_RESPONSE_CACHE_PATH, request_key, shared_cache
+
 
 class SEDSolverSignature(dspy.Signature):
     """
@@ -25,6 +36,33 @@ class SEDSolverSignature(dspy.Signature):
     )
 
 
+class CachedLM(dspy.LM):
+    """
+    dspy.LM whose deterministic calls are answered from a ResponseCache, keyed by
+    model, full prompt and sampling params; calls with temperature > 0 always go
+    to the model. Use instead of DSPy's own cache, which is turned off.
+    """
+
+    def __init__(self, model, cache_path=DEFAULT_RESPONSE_CACHE_PATH, **kwargs):
+        super().__init__(model, cache=False, **kwargs)
+        # Only the path is kept, so copies of the LM share one open cache
+        self.cache_path = cache_path
+
+    @property
+    def response_cache(self):
+        return shared_cache(self.cache_path)
+
+    def __call__(self, prompt=None, messages=None, **kwargs):
+        messages = messages or [{"role": "user", "content": prompt}]
+        key = request_key(self.model, messages, {**self.kwargs, **kwargs})
+        hit, outputs = self.response_cache.lookup(key)
+        if hit:
+            return outputs
+        outputs = super().__call__(messages=messages, **kwargs)
+        self.response_cache.store(key, self.model, outputs)
+        return outputs
+
+
 class ZeroShotSEDSolver(dspy.Module):
     def __init__(self):
         super().__init__()
@@ -57,19 +95,15 @@ def problem_to_string(problem):
     return json.dumps(problem, indent=2)
 
 
+@lru_cache(maxsize=4096)
+def problem_verifier(problem_str):
+    """Verifier for a problem JSON string, parsed once and reused across metric calls"""
+    return Verifier.from_dict(json.loads(problem_str))
+
+
 def verify_solution(problem, solution_indices):
-    current = problem["initial_string"]
-    transitions = problem["transitions"]
-    for idx in solution_indices:
-        idx = int(idx)
-        if idx < 0 or idx >= len(transitions):
-            return False
-        trans = transitions[idx]
-        if trans["src"] not in current:
-            return False
-        i = current.find(trans["src"])
-        current = current[:i] + trans["tgt"] + current[i + len(trans["src"]):]
-    return current == ""
+    verifier = problem_verifier(problem) if isinstance(problem, str) else Verifier.from_dict(problem)
+    return verifier.check([int(idx) for idx in solution_indices]).valid
 
 
 def validity_metric(example, pred, trace=None):
@@ -78,15 +112,13 @@ def validity_metric(example, pred, trace=None):
         if not pred_solution_str:
             return 0.0
 
-        problem = json.loads(example["problem"])
-
         try:
             solution_data = json.loads(pred_solution_str)
             solution_indices = solution_data.get("solution", []) if isinstance(solution_data, dict) else solution_data
         except:
             solution_indices = ast.literal_eval(pred_solution_str)
 
-        return float(verify_solution(problem, solution_indices))
+        return float(verify_solution(example["problem"], solution_indices))
     except:
         return 0.0
     
@@ -95,25 +127,28 @@ def load_dataset(problem_dir: str, solution_dir: str,
                  problem_ids: List[str] = None,
                  sample_size: int = None,
                  seed: int = 42) -> List[dspy.Example]:
-    all_ids = sorted(f.replace(".json", "") for f in os.listdir(problem_dir) if f.endswith(".json"))
-    if problem_ids is not None:
-        all_ids = [pid for pid in problem_ids if pid in all_ids]
-    if sample_size and sample_size < len(all_ids):
-        random.seed(seed)
-        all_ids = random.sample(all_ids, sample_size)
-
-    examples = []
-    for pid in all_ids:
-        try:
-            problem = load_json(os.path.join(problem_dir, f"{pid}.json"))
-            solution = load_json(os.path.join(solution_dir, f"{pid}.json"))
-            ex = dspy.Example(
-                problem = problem_to_string(problem),
-                solution=json.dumps(solution)
-            ).with_inputs("problem")
-            examples.append(ex)
-        except FileNotFoundError:
-            continue
+    # Either directory may also be a packed corpus file (see sed-solver/corpus.py)
+    with open_corpus(problem_dir) as problems, open_corpus(solution_dir) as solutions:
+        all_ids = problems.ids()
+        if problem_ids is not None:
+            known = set(all_ids)
+            all_ids = [pid for pid in problem_ids if pid in known]
+        if sample_size and sample_size < len(all_ids):
+            random.seed(seed)
+            all_ids = random.sample(all_ids, sample_size)
+
+        examples = []
+        for pid in all_ids:
+            try:
+                problem = problems[pid]
+                solution = solutions[pid]
+                ex = dspy.Example(
+                    problem = problem_to_string(problem),
+                    solution=json.dumps(solution)
+                ).with_inputs("problem")
+                examples.append(ex)
+            except KeyError:
+                continue
     return examples
 
 
@@ -129,32 +164,114 @@ def split_dataset(examples: List[dspy.Example],
     return shuffled[:train_end], shuffled[train_end:val_end], shuffled[val_end:]
 
 
-def evaluate_module(module: dspy.Module, examples: list, metric_fn = validity_metric):
+def example_id(example):
+    """Problem id of an example, or a hash of its problem text if it has none"""
+    try:
+        return str(json.loads(example["problem"])["problem_id"])
+    except (ValueError, KeyError, TypeError):
+        return hashlib.sha256(example["problem"].encode()).hexdigest()[:16]
 
-    total = len(examples)
-    correct = 0
-    results = []
 
-    for example in examples:
-        try:
-            pred = module(problem=example["problem"])
-            score = metric_fn(example, pred)
-            correct += score
-
-            results.append({
-                "problem": example["problem"][:100],
-                "prediction": pred.solution[:200],
-                "ground_truth": example["solution"][:200],
-                "score": score
-            })
-        except Exception as e:
-            print(f"Error evaluating example: {e}")
-            results.append({
-                "problem": example["problem"][:100],
-                "error": str(e),
-                "score": 0.0
-            })
+def module_fingerprint(module):
+    """Hash of a module's instructions and demos, so results of another program are never resumed"""
+    return hashlib.sha256(json.dumps(module.dump_state(), sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def read_jsonl(path):
+    """Records of a JSONL file, skipping a line cut short by a crash"""
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def load_results(path, fingerprint):
+    """
+    Finished results by example id from a results file written for the same
+    module, or None if there is no such file. Errors are left to be retried.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    records = read_jsonl(path)
+    if not records or records[0].get("module") != fingerprint:
+        return None
+    done = {}
+    for result in records[1:]:
+        if "error" in result:
+            done.pop(result["id"], None)
+        else:
+            done[result["id"]] = result
+    return done
+
+
+def evaluate_one(module, example, metric_fn):
+    try:
+        pred = module(problem=example["problem"])
+        score = metric_fn(example, pred)
+        return {
+            "problem": example["problem"][:100],
+            "prediction": pred.solution[:200],
+            "ground_truth": example["solution"][:200],
+            "score": score
+        }
+    except Exception as e:
+        print(f"Error evaluating example: {e}")
+        return {
+            "problem": example["problem"][:100],
+            "error": str(e),
+            "score": 0.0
+        }
+
+
+def evaluate_module(module: dspy.Module, examples: list, metric_fn = validity_metric,
+                    num_threads: int = 1, results_path: str = None):
+    """
+    Scores module on examples with num_threads calls in flight. With results_path,
+    every result is appended to that JSONL file as soon as it completes, and a
+    rerun of the same module skips the examples already scored there.
+    """
+    ids = [example_id(example) for example in examples]
+    fingerprint = module_fingerprint(module) if results_path else None
+    done = load_results(results_path, fingerprint)
+
+    out = None
+    if results_path:
+        os.makedirs(os.path.dirname(results_path) or ".", exist_ok=True)
+        if done is None:
+            out = open(results_path, "w")
+            out.write(json.dumps({"module": fingerprint}) + "\n")
+        else:
+            out = open(results_path, "a")
+            out.write("\n")  # ends a line cut short by a crash; blank lines are skipped
+        out.flush()
+    done = done or {}
+    lock = threading.Lock()
+
+    def run(index):
+        result = evaluate_one(module, examples[index], metric_fn)
+        if out is not None:
+            with lock:
+                out.write(json.dumps({"id": ids[index], **result}) + "\n")
+                out.flush()
+        return result
+
+    pending = [i for i, eid in enumerate(ids) if eid not in done]
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, num_threads)) as pool:
+            fresh = dict(zip(pending, pool.map(run, pending)))
+    finally:
+        if out is not None:
+            out.close()
+
+    results = [fresh[i] if i in fresh else {k: v for k, v in done[eid].items() if k != "id"}
+               for i, eid in enumerate(ids)]
 
+    total = len(examples)
+    correct = sum(result["score"] for result in results)
     accuracy = correct / total if total > 0 else 0.0
 
     return {
@@ -2,22 +2,22 @@ import os
 import dspy
 import json
 from dotenv import load_dotenv
+from base import CachedLM
 
 # Configure DSPy with your LM
-llm = dspy.LM(model="openai/local-model",
-              api_base="http://localhost:8080/v1",
-              api_key="local",
-              temperature=0.0,
-              max_tokens=76000,
-              chat=True)
+llm = CachedLM(model="openai/local-model",
+               api_base="http://localhost:8080/v1",
+               api_key="local",
+               temperature=0.0,
+               max_tokens=76000,
+               chat=True)
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-gemini = dspy.LM("gemini/gemini-2.5-flash", api_key = GEMINI_API_KEY)
+gemini = CachedLM("gemini/gemini-2.5-flash", api_key = GEMINI_API_KEY)
 
 # dspy.configure(lm = llm, adapter=dspy.ChatAdapter())
 dspy.configure(lm = gemini, adapter=dspy.ChatAdapter())
-dspy.settings.configure(cache=False)
 
 
 class SEDSolverSignature(dspy.Signature):
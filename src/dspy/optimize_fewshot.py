@@ -1,23 +1,22 @@
 import os
 import dspy
 from dotenv import load_dotenv
-from dspy.teleprompt import BootstrapFewShotWithRandomSearch
-from base import load_dataset, split_dataset, validity_metric, evaluate_module, SEDSolverSignature
+from base import load_dataset, split_dataset, validity_metric, evaluate_module, SEDSolverSignature, CachedLM
+from racing import bootstrap_candidates, race_candidates
 
-llm = dspy.LM(model="openai/local-model",
-              api_base="http://localhost:8080/v1",
-              api_key="local",
-              temperature=0.0,
-              max_tokens=16000,
-              chat=True)
+llm = CachedLM(model="openai/local-model",
+               api_base="http://localhost:8080/v1",
+               api_key="local",
+               temperature=0.0,
+               max_tokens=16000,
+               chat=True)
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-gemini = dspy.LM("gemini/gemini-2.5-flash", api_key = GEMINI_API_KEY)
+gemini = CachedLM("gemini/gemini-2.5-flash", api_key = GEMINI_API_KEY)
 
 dspy.configure(lm = llm, adapter=dspy.ChatAdapter())
 # dspy.configure(lm = gemini, adapter=dspy.ChatAdapter())
-dspy.settings.configure(cache=False)
 
 examples = load_dataset("./data/problems", "./data/solutions")
 train, val, test = split_dataset(examples)
@@ -25,20 +24,20 @@ print(f"Loaded {len(examples)} examples: {len(train)} train, {len(val)} val, {le
 
 program = dspy.Predict(SEDSolverSignature)
 
-teleprompter = BootstrapFewShotWithRandomSearch(
-    metric=validity_metric,
-    max_bootstrapped_demos=2,
-    max_labeled_demos=2,
-    num_candidate_programs=10,
-    num_threads=4
-)
-
-print("Optimizing few-shot prompt with BootstrapFewShotWithRandomSearch...")
-optimized_program = teleprompter.compile(
+# Same candidates as BootstrapFewShotWithRandomSearch, but raced on the validation set:
+# candidates that clearly lose on the first minibatches are not run on the rest
+print("Optimizing few-shot prompt with bootstrapped candidates and racing...")
+candidates = bootstrap_candidates(
     program,
-    trainset=train,
-    valset=val
+    train,
+    validity_metric,
+    num_candidate_programs=10,
+    max_bootstrapped_demos=2,
+    max_labeled_demos=2
 )
+race = race_candidates(candidates, val, validity_metric, num_threads=4)
+print(f"Race: {race}")
+optimized_program = race.best
 
 optimized_program.save("optimized_fewshot_cot.json")
 print("Saved optimized few-shot CoT program to optimized_fewshot_cot.json")
@@ -46,5 +45,6 @@ print("Saved optimized few-shot CoT program to optimized_fewshot_cot.json")
 # Evaluate on test set
 print("\nEvaluating on test set...")
 from base import evaluate_module
-results = evaluate_module(optimized_program, test, validity_metric)
+results = evaluate_module(optimized_program, test, validity_metric,
+                          num_threads=4, results_path="./data/dspy_eval/fewshot_test.jsonl")
 print(f"Test accuracy: {results['accuracy']:.2%} ({results['correct']}/{results['total']})")
@@ -2,22 +2,21 @@ import os
 import dspy
 from dotenv import load_dotenv
 from dspy.teleprompt import MIPROv2
-from base import load_dataset, split_dataset, validity_metric, evaluate_module, SEDSolverSignature
+from base import load_dataset, split_dataset, validity_metric, evaluate_module, SEDSolverSignature, CachedLM
 
-llm = dspy.LM(model="openai/local-model",
-              api_base="http://localhost:8080/v1",
-              api_key="local",
-              temperature=0.0,
-              max_tokens=76000,
-              chat=True)
+llm = CachedLM(model="openai/local-model",
+               api_base="http://localhost:8080/v1",
+               api_key="local",
+               temperature=0.0,
+               max_tokens=76000,
+               chat=True)
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-gemini = dspy.LM("gemini/gemini-2.5-flash", api_key = GEMINI_API_KEY)
+gemini = CachedLM("gemini/gemini-2.5-flash", api_key = GEMINI_API_KEY)
 
 # dspy.configure(lm = llm, adapter=dspy.ChatAdapter())
 dspy.configure(lm = gemini, adapter=dspy.ChatAdapter())
-dspy.settings.configure(cache=False)
 
 examples = load_dataset("./data/problems", "./data/solutions")
 train, val, test = split_dataset(examples)
@@ -46,5 +45,6 @@ print("Saved optimized program to optimized_zero_shot.json")
 # Evaluate on test set
 print("\nEvaluating on test set...")
 from base import evaluate_module
-results = evaluate_module(optimized_program, test, validity_metric)
+results = evaluate_module(optimized_program, test, validity_metric,
+                          num_threads=4, results_path="./data/dspy_eval/zero_shot_test.jsonl")
 print(f"Test accuracy: {results['accuracy']:.2%} ({results['correct']}/{results['total']})")
@@ -0,0 +1,128 @@
+import math
+import random
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import dspy
+from dspy.teleprompt import BootstrapFewShot, LabeledFewShot
+
+from base import evaluate_one, validity_metric
+
+
+@dataclass
+class RaceResult:
+    """Outcome of race_candidates; calls counts program calls, one LM call each for a Predict program"""
+    best: dspy.Module
+    best_index: int
+    scores: List[float]  # mean score of every candidate over the examples it was run on
+    evaluated: List[int]  # examples every candidate was run on
+    calls: int = 0
+    full_calls: int = 0  # calls a full evaluation of every candidate would have made
+    dropped: List[int] = field(default_factory=list)  # candidate indices in order of elimination
+
+    def __str__(self):
+        saved = 1 - self.calls / self.full_calls if self.full_calls else 0.0
+        return (f"candidate {self.best_index} won ({self.scores[self.best_index]:.2%} on {self.evaluated[self.best_index]} examples); "
+                f"{self.calls}/{self.full_calls} program calls, {saved:.0%} saved")
+
+
+def sign_test(wins, losses):
+    """One-sided p-value of at least losses losses out of wins + losses, if either outcome were equally likely"""
+    n = wins + losses
+    return sum(math.comb(n, k) for k in range(losses, n + 1)) / 2 ** n
+
+
+def beaten(scores, incumbent, remaining, threshold):
+    """
+    True if a candidate can no longer beat the incumbent: not even by getting every
+    remaining example right while the incumbent gets them all wrong, or it loses a
+    sign test against the incumbent on the examples both were run on.
+    """
+    if sum(scores) + remaining < sum(incumbent):
+        return True
+    wins = sum(a > b for a, b in zip(scores, incumbent))
+    losses = sum(a < b for a, b in zip(scores, incumbent))
+    return sign_test(wins, losses) < threshold
+
+
+def race_candidates(candidates, examples, metric_fn=validity_metric, min_batch=8, growth=2,
+                    alpha=0.05, num_threads=1, seed=0) -> RaceResult:
+    """
+    Picks the best of several candidate programs without running all of them on every example.
+
+    All surviving candidates are run on the same growing prefix of the shuffled
+    examples (min_batch, then growth times larger each round). After each round,
+    the candidate with the highest total is the incumbent and every candidate
+    that is beaten by it is dropped. The sign test level alpha is split over all
+    comparisons of the race. Ties go to the earlier candidate, as when every
+    candidate is evaluated in full.
+    """
+    order = list(range(len(examples)))
+    random.Random(seed).shuffle(order)
+    rounds = 1 + max(0, math.ceil(math.log(max(len(examples), 1) / min_batch, growth)))
+    threshold = alpha / max(1, (len(candidates) - 1) * rounds)
+
+    scores = [[] for _ in candidates]
+    alive = list(range(len(candidates)))
+    dropped = []
+    seen, batch = 0, min_batch
+
+    def run(job):
+        c, j = job
+        return evaluate_one(candidates[c], examples[order[j]], metric_fn)["score"]
+
+    with ThreadPoolExecutor(max_workers=max(1, num_threads)) as pool:
+        while True:
+            upto = min(len(examples), batch)
+            jobs = [(c, j) for c in alive for j in range(seen, upto)]
+            for (c, _), score in zip(jobs, pool.map(run, jobs)):
+                scores[c].append(score)
+            seen = upto
+
+            incumbent = max(alive, key=lambda c: (sum(scores[c]), -c))
+            survivors = [c for c in alive if c == incumbent
+                         or not beaten(scores[c], scores[incumbent], len(examples) - seen, threshold)]
+            dropped += [c for c in alive if c not in survivors]
+            alive = survivors
+            if seen == len(examples) or len(alive) == 1:
+                break
+            batch *= growth
+
+    best = max(alive, key=lambda c: (sum(scores[c]), -c))
+    evaluated = [len(s) for s in scores]
+    return RaceResult(
+        best=candidates[best],
+        best_index=best,
+        scores=[sum(s) / len(s) if s else 0.0 for s in scores],
+        evaluated=evaluated,
+        calls=sum(evaluated),
+        full_calls=len(candidates) * len(examples),
+        dropped=dropped,
+    )
+
+
+def bootstrap_candidates(student, trainset, metric_fn=validity_metric, num_candidate_programs=10,
+                         max_bootstrapped_demos=4, max_labeled_demos=16):
+    """
+    The candidate programs BootstrapFewShotWithRandomSearch builds: zero-shot,
+    labeled demos only, unshuffled bootstrap, then num_candidate_programs
+    bootstraps over seeded shuffles of the trainset. Score them with race_candidates.
+    """
+    candidates = []
+    for seed in range(-3, num_candidate_programs):
+        trainset_copy = list(trainset)
+        if seed == -3:
+            program = student.reset_copy()
+        elif seed == -2:
+            program = LabeledFewShot(k=max_labeled_demos).compile(student, trainset=trainset_copy)
+        else:
+            size = max_bootstrapped_demos
+            if seed >= 0:
+                random.Random(seed).shuffle(trainset_copy)
+                size = random.Random(seed).randint(1, max_bootstrapped_demos)
+            optimizer = BootstrapFewShot(metric=metric_fn, max_bootstrapped_demos=size,
+                                         max_labeled_demos=max_labeled_demos)
+            program = optimizer.compile(student, trainset=trainset_copy)
+        candidates.append(program)
+    return candidates
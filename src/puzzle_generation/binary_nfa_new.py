@@ -91,10 +91,11 @@ def save_puzzles(generator, count, difficulties, problems_dir, metadata_dir, pre
     return counter
 
 
-nfa_gen = NFAPuzzleGenerator()
-bin_gen = BinaryPuzzleGenerator()
+if __name__ == "__main__":
+    nfa_gen = NFAPuzzleGenerator()
+    bin_gen = BinaryPuzzleGenerator()
 
-nfa_count = save_puzzles(nfa_gen.generate_nfa_puzzle, 10, range(1, 5), "./data/problems", "./data/metadata", "NFA")
-bin_count = save_puzzles(bin_gen.generate_binary_puzzle, 10, range(1, 5), "./data/problems", "./data/metadata", "BIN")
+    nfa_count = save_puzzles(nfa_gen.generate_nfa_puzzle, 10, range(1, 5), "./data/problems", "./data/metadata", "NFA")
+    bin_count = save_puzzles(bin_gen.generate_binary_puzzle, 10, range(1, 5), "./data/problems", "./data/metadata", "BIN")
 
-print(f"Generated {nfa_count} NFA puzzles and {bin_count} Binary puzzles.")
+    print(f"Generated {nfa_count} NFA puzzles and {bin_count} Binary puzzles.")
@@ -53,12 +53,6 @@ class SedPuzzleGenerator:
         }, {"difficulty_profile": {"entropy": entropy, "branching": branching, "symbols": sym}}
 
 
-generator = SedPuzzleGenerator()
-problems_dir = "./data/problems"
-metadata_dir = "./data/metadata"
-os.makedirs(problems_dir, exist_ok=True)
-os.makedirs(metadata_dir, exist_ok=True)
-
 def sample_profiles(range_min, range_max, num_samples):
     axes = [list(range(range_min[i], range_max[i]+1)) for i in range(3)]
     combos = list(itertools.product(*axes))
@@ -72,15 +66,22 @@ all_ranges = [
     ((3,3,3),(4,4,4),20)
 ]
 
-puzzle_counter = 0
-for rmin, rmax, num in all_ranges:
-    profiles = sample_profiles(rmin, rmax, num)
-    for profile in profiles:
-        puzzle, meta = generator.generate_puzzle(puzzle_counter, profile)
-        pid = puzzle["problem_id"]
-        json.dump(puzzle, open(f"{problems_dir}/{pid}.json","w"), indent=2)
-        json.dump(meta, open(f"{metadata_dir}/{pid}.json","w"), indent=2)
-        print(f"Generated puzzle {pid}")
-        puzzle_counter += 1
+if __name__ == "__main__":
+    generator = SedPuzzleGenerator()
+    problems_dir = "./data/problems"
+    metadata_dir = "./data/metadata"
+    os.makedirs(problems_dir, exist_ok=True)
+    os.makedirs(metadata_dir, exist_ok=True)
+
+    puzzle_counter = 0
+    for rmin, rmax, num in all_ranges:
+        profiles = sample_profiles(rmin, rmax, num)
+        for profile in profiles:
+            puzzle, meta = generator.generate_puzzle(puzzle_counter, profile)
+            pid = puzzle["problem_id"]
+            json.dump(puzzle, open(f"{problems_dir}/{pid}.json","w"), indent=2)
+            json.dump(meta, open(f"{metadata_dir}/{pid}.json","w"), indent=2)
+            print(f"Generated puzzle {pid}")
+            puzzle_counter += 1
 
-print(f"\nGenerated {puzzle_counter} puzzles in {problems_dir}/ and metadata in {metadata_dir}/")
+    print(f"\nGenerated {puzzle_counter} puzzles in {problems_dir}/ and metadata in {metadata_dir}/")
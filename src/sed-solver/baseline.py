@@ -2,74 +2,157 @@
 
 import os
 import json
-import time
-from utils import read_problem_folder, write_solution_folder
+import argparse
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils import read_problem_folder, read_metadata_folder, write_solution_folder
+from search import SOLVERS
+from cache import SolutionCache
+from invariants import find_certificate
+from stats import SearchStats
 from schema import Solution
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 
-def bfs(problem, time_limit=5):
-    initial = problem.initial_string
-    transitions = problem.transitions
-
-    queue = [(initial, 0)]
-    operation = {initial: -1}  # Map current string to the transition index used
-    parent = {initial: None}  # Map current string to its parent string
-    start_time = time.time()  # Record the start time
-
-    while queue:
-        current_string, steps = queue.pop(0)
-
-        if time.time() - start_time > time_limit:
-            return None
-
-        # Check if the target string is empty
-        if current_string == "":
-            solution = []
-            while current_string is not None:
-                operation_index = operation[current_string]
-                if operation_index != -1:
-                    solution.append(operation_index)
-                current_string = parent[current_string]
-
-            return solution[::-1]  # Reverse to get the correct order
-
-        # Process all transitions
-        for i, transition in enumerate(transitions):
-            src = transition.src
-            tgt = transition.tgt
-
-            pos = current_string.find(src) if src else 0
-            if pos != -1:
-                new_string = current_string[:pos] + tgt + current_string[pos + len(src):]
-
-                if new_string not in operation:
-                    operation[new_string] = i  # Store the transition index
-                    parent[new_string] = current_string
-                    queue.append((new_string, steps + 1))
+def profile_family(profile):
+    return (profile or {}).get("type", "general")
+
+def profile_scales(metadata):
+    """Largest value of every numeric profile field within each puzzle family"""
+    scales = {}
+    for profile in metadata.values():
+        for field, value in (profile or {}).items():
+            if isinstance(value, int):
+                key = (profile_family(profile), field)
+                scales[key] = max(scales.get(key, 0), value)
+    return scales
+
+def estimate_cost(problem, profile, scales):
+    """
+    Rough ordering key for how long a puzzle takes to solve, from its difficulty
+    profile. The families use different fields on different scales, so every
+    field is scaled by its largest value within the family before averaging.
+    """
+    family = profile_family(profile)
+    fields = [value / scales[family, field] for field, value in (profile or {}).items()
+              if isinstance(value, int) and scales.get((family, field))]
+    difficulty = sum(fields) / len(fields) if fields else 0.0
+    return difficulty, len(problem.initial_string), len(problem.srcs)
+
+def measured_costs(stats_path, method):
+    """Search time of every puzzle in an earlier run of method, if its statistics were saved"""
+    try:
+        with open(stats_path) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if saved.get("method") != method:
+        return {}
+    return {pid: stats["elapsed"] for pid, stats in saved.get("problems", {}).items()
+            if stats.get("stop_reason") != "cached"}
+
+def schedule(problems, metadata, measured=None):
+    """
+    Puzzles in the order to submit them, longest first so none straggles at the
+    end of the batch: those without a measured time by their difficulty profile,
+    then the rest by the time they took last run.
+    """
+    measured = measured or {}
+    scales = profile_scales(metadata)
+
+    def key(problem):
+        if problem.problem_id in measured:
+            return 0, measured[problem.problem_id]
+        return 1, estimate_cost(problem, metadata.get(problem.problem_id), scales)
+
+    return sorted(problems, key=key, reverse=True)
+
+def solve_problem(method, problem, time_limit, max_nodes=None, encoding="str"):
+    # Runs inside a worker process; the solver enforces the time budget itself
+    stats = SearchStats()
+    certificate = find_certificate(problem)
+    if certificate is not None:
+        stats.stop_reason = "certificate"
+        return problem.problem_id, None, certificate, stats.as_dict()
+    options = {"encoding": encoding} if method == "bfs" else {}
+    solution = SOLVERS[method](problem, time_limit=time_limit, stats=stats, max_nodes=max_nodes, **options)
+    return problem.problem_id, solution, None, stats.as_dict()
+
+def main(method="bfs", workers=None, time_limit=5, use_cache=True, max_nodes=None,
+         stats_path="./data/solver_stats.json", encoding="str", trace_memory=False):
+    # Load the generated puzzles
+    problems = read_problem_folder(compiled=True)
+    metadata = read_metadata_folder()
+    cache = SolutionCache() if use_cache else None
 
-    return None  # No solution found
+    # Hardest puzzles first so they do not straggle at the end of the batch
+    ordered = schedule(problems.values(), metadata, measured_costs(stats_path, method))
 
-def main():
-    # Load the generated puzzles
-    problems = read_problem_folder()
+    solved = 0
+    search_stats = {}
 
-    solutions = {}
-    for problem in problems.values():
+    def record(problem_id, solution, certificate=None):
+        nonlocal solved
         logging.info("=====================================================")
-        solution = bfs(problem)
         if solution is not None:
-            solutions[problem.problem_id] = Solution(
-                problem_id = problem.problem_id,
+            solved += 1
+            logging.info(f"Solution found for puzzle {problem_id}")
+            # Stream each solution to disk as soon as it is found
+            write_solution_folder({problem_id: Solution(
+                problem_id = problem_id,
                 solution = solution
-            )
-            logging.info(f"Solution found for puzzle {problem.problem_id}")
+            )})
+        elif certificate is not None:
+            logging.info(f"Puzzle {problem_id} is unsolvable: {certificate}")
         else:
-            logging.info(f"Baseline exceedes time limit for puzzle {problem.problem_id}")
-
-    write_solution_folder(solutions)
+            logging.info(f"Baseline exceedes time limit for puzzle {problem_id}")
+
+    # Answer what the cache already knows without searching again
+    pending = []
+    for problem in ordered:
+        hit, solution = cache.lookup(problem, time_limit) if cache else (False, None)
+        if hit:
+            search_stats[problem.problem_id] = SearchStats(stop_reason="cached").as_dict()
+            record(problem.problem_id, solution)
+        else:
+            pending.append(problem)
+    if cache:
+        logging.info(f"{len(ordered) - len(pending)} puzzles answered from the solution cache")
+
+    # Tracing gives exact per-puzzle memory peaks but slows the searches down
+    with ProcessPoolExecutor(max_workers=workers, initializer=tracemalloc.start if trace_memory else None) as pool:
+        futures = [pool.submit(solve_problem, method, problem, time_limit, max_nodes, encoding) for problem in pending]
+        for future in as_completed(futures):
+            problem_id, solution, certificate, stats = future.result()
+            search_stats[problem_id] = stats
+            if cache and (solution is not None or stats["stop_reason"] != "node_limit"):
+                cache.store(problems[problem_id], solution, time_limit, method)
+            record(problem_id, solution, certificate)
+
+    if cache:
+        cache.close()
+    logging.info(f"Solved {solved}/{len(problems)} puzzles")
+
+    # Per-puzzle search cost, for comparing methods and tuning budgets
+    with open(stats_path, "w") as f:
+        json.dump({"method": method, "time_limit": time_limit, "max_nodes": max_nodes,
+                   "problems": dict(sorted(search_stats.items()))}, f, indent=2)
+    logging.info(f"Search statistics written to {stats_path}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Solve every puzzle with a baseline search")
+    parser.add_argument("--method", choices=sorted(SOLVERS), default="bfs")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (defaults to the CPU count)")
+    parser.add_argument("--time_limit", type=float, default=5, help="Time budget per puzzle in seconds")
+    parser.add_argument("--no_cache", action="store_true", help="Ignore the on-disk solution cache")
+    parser.add_argument("--max_nodes", type=int, default=None, help="Node budget per puzzle, for reproducible runs")
+    parser.add_argument("--stats", default="./data/solver_stats.json", help="Where to write per-puzzle search statistics")
+    parser.add_argument("--encoding", choices=["str", "packed", "auto"], default="str",
+                        help="State encoding for bfs; packed uses less memory but expands nodes more slowly")
+    parser.add_argument("--trace_memory", action="store_true", help="Record exact per-puzzle memory peaks with tracemalloc (slower)")
+    args = parser.parse_args()
+    main(method=args.method, workers=args.workers, time_limit=args.time_limit, use_cache=not args.no_cache,
+         max_nodes=args.max_nodes, stats_path=args.stats, encoding=args.encoding,
+         trace_memory=args.trace_memory)
\ No newline at end of file
@@ -1,15 +1,33 @@
 import json, re, csv, time, logging
 from pathlib import Path
 from typing import Dict, List, Optional
-from schema import Problem, Solution
+from schema import Solution
 from utils import read_problem_folder, read_solution_folder
-from solve_and_visualize import bfs
+from search import bfs
+from cache import SolutionCache, solve_cached
+from invariants import find_certificate
+from oracle import OracleCache
+from verifier import Verifier, Verdict
+from compiled import compile_problem
+from stats import SearchStats
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 
+# Largest closure an oracle is built for; a problem whose closure does not fit is
+# left to continuation searches
+ORACLE_MAX_STATES = 10_000
+ORACLE_TIME_LIMIT = 1
+
+# Cost of the continuation search, when one had to run
+SEARCH_FIELDS = ["nodes_expanded", "peak_frontier", "nodes_per_sec", "stop_reason"]
+SEARCH_FIELDS_EMPTY = {f"search_{field}": None for field in SEARCH_FIELDS}
+
 
 def parse_batch_response_file(path: Path) -> List[Dict]:
-    text = path.read_text()
+    return parse_batch_response_text(path.read_text())
+
+
+def parse_batch_response_text(text: str) -> List[Dict]:
     blocks = re.findall(r"```json\s*(.*?)\s*```", text, re.DOTALL)
     out = []
     for b in blocks:
@@ -22,24 +40,30 @@ def parse_batch_response_file(path: Path) -> List[Dict]:
     return out
 
 
-def apply_solution(problem: Problem, sol: List[int]) -> str:
-    cur = problem.initial_string
-    for i in sol:
-        if i >= len(problem.transitions):
-            break
-        t = problem.transitions[i]
-        pos = cur.find(t.src) if t.src else 0
-        if pos == -1:
-            break
-        cur = cur[:pos] + t.tgt + cur[pos + len(t.src):]
-    return cur
-
-def is_valid(problem: Problem, sol: List[int]) -> bool:
-    return apply_solution(problem, sol) == ""
-
-
-
-def analyze(resp: Dict, problems, baselines) -> Dict:
+def check_responses(responses, problems) -> Dict:
+    """
+    Verdicts of every answer with an integer solution to a known problem, keyed
+    by (problem_id, solution). All answers to one problem, from every batch
+    file, are replayed in one Verifier.check_many call.
+    """
+    candidates = {}
+    for resp in responses:
+        try:
+            sol = tuple(int(x) for x in resp["solution"])
+        except Exception:
+            continue
+        if resp["problem_id"] in problems:
+            candidates.setdefault(resp["problem_id"], set()).add(sol)
+    verdicts = {}
+    for pid, sols in candidates.items():
+        sols = list(sols)
+        verdicts.update(((pid, sol), verdict)
+                        for sol, verdict in zip(sols, Verifier.from_problem(problems[pid]).check_many(sols)))
+    return verdicts
+
+
+def analyze(resp: Dict, problems, baselines, cache: Optional[SolutionCache] = None,
+            oracles: Optional[OracleCache] = None, verdicts: Optional[Dict[tuple, Verdict]] = None) -> Dict:
     pid = resp["problem_id"]
 
     try:
@@ -53,11 +77,15 @@ def analyze(resp: Dict, problems, baselines) -> Dict:
             "unsolved_percentage": None,
             "early_stop": None,
             "deadend": None,
+            "steps_remaining": None,
+            "certificate": None,
+            **SEARCH_FIELDS_EMPTY,
             "error": "non-integer solution format",
         }
     r = dict(problem_id=pid, is_valid=False, llm_solution_length=len(sol),
              baseline_solution_length=None, unsolved_percentage=None,
-             early_stop=None, deadend=None, error=None)
+             early_stop=None, deadend=None, steps_remaining=None, certificate=None,
+             **SEARCH_FIELDS_EMPTY, error=None)
 
     if pid not in problems:
         r["error"] = "missing problem"
@@ -67,37 +95,63 @@ def analyze(resp: Dict, problems, baselines) -> Dict:
     if pid in baselines:
         r["baseline_solution_length"] = len(baselines[pid].solution)
 
-    if is_valid(p, sol):
+    verdict = verdicts.get((pid, tuple(sol))) if verdicts is not None else None
+    if verdict is None:
+        verdict = Verifier.from_problem(p).check(sol)
+    # Reaching the null string counts even if later steps do not apply
+    rem = verdict.final
+    if rem == "":
         r["is_valid"] = True
         return r
 
-    rem = apply_solution(p, sol)
     r["unsolved_percentage"] = 100 * len(rem) / max(len(p.initial_string), 1)
 
-    if rem == "":
-        r["is_valid"] = True
-        return r
+    # The per-problem oracle answers most leftovers with a lookup
+    oracle = oracles.get(p) if oracles is not None else None
+    if oracle is not None:
+        steps = oracle.steps_remaining(rem)
+        if steps is not None or oracle.is_deadend(rem):
+            r["early_stop"] = steps is not None
+            r["deadend"] = steps is None
+            r["steps_remaining"] = steps
+            return r
 
     # Create a temporary problem with the remaining string to check if solution can continue
-    temp_problem = Problem(
-        problem_id=p.problem_id,
-        initial_string=rem,
-        transitions=p.transitions
-    )
-    cont = bfs(temp_problem, time_limit=5)
+    temp_problem = compile_problem(p)._replace(initial_string=rem)
+    # A proof of unsolvability settles it without searching
+    certificate = find_certificate(temp_problem)
+    if certificate is not None:
+        r["early_stop"] = False
+        r["deadend"] = True
+        r["certificate"] = str(certificate)
+        return r
+
+    stats = SearchStats()
+    cont = solve_cached(temp_problem, bfs, time_limit=5, cache=cache, stats=stats)
+    if oracles is not None:
+        oracles.record_search(pid, stats.nodes_expanded)
+    for field in SEARCH_FIELDS:
+        r[f"search_{field}"] = getattr(stats, field)
     r["early_stop"] = cont is not None
     r["deadend"] = cont is None
+    r["steps_remaining"] = len(cont) if cont is not None else None
     return r
 
 
-def process_batch(batch: Path, problems, baselines, outdir: Path):
+def process_batch(batch: Path, problems, baselines, outdir: Path, cache: Optional[SolutionCache] = None,
+                  oracles: Optional[OracleCache] = None, responses: Optional[List[Dict]] = None,
+                  verdicts: Optional[Dict[tuple, Verdict]] = None):
+    """Writes the analysis of one batch file; responses are its parsed answers, if already read"""
     logging.info(f"\n=== {batch.name} ===")
-    rows = [analyze(r, problems, baselines) for r in parse_batch_response_file(batch)]
+    if responses is None:
+        responses = parse_batch_response_file(batch)
+    rows = [analyze(r, problems, baselines, cache, oracles, verdicts) for r in responses]
     out = outdir / f"{batch.stem}_analysis.csv"
 
     fields = ["problem_id","is_valid","llm_solution_length",
               "baseline_solution_length","unsolved_percentage",
-              "early_stop","deadend","error"]
+              "early_stop","deadend","steps_remaining","certificate",
+              *SEARCH_FIELDS_EMPTY,"error"]
 
     with open(out, "w", newline="") as f:
         w = csv.DictWriter(f, fieldnames=fields)
@@ -119,14 +173,19 @@ def main():
     out = Path("./data/batch_analysis_markov")
     out.mkdir(exist_ok=True)
 
-    problems = read_problem_folder(base / "problems")
+    problems = read_problem_folder(base / "problems", compiled=True)
     baselines = read_solution_folder(base / "solutions")
 
     files = sorted(p for d in batches.iterdir() if d.is_dir() for p in d.glob("*.txt"))
     logging.info(f"Processing {len(files)} batch files")
-
-    for f in files:
-        process_batch(f, problems, baselines, out)
+    responses = {f: parse_batch_response_file(f) for f in files}
+    verdicts = check_responses((r for f in files for r in responses[f]), problems)
+
+    # Oracles are shared by every batch file naming the same problem
+    oracles = OracleCache(max_states=ORACLE_MAX_STATES, time_limit=ORACLE_TIME_LIMIT)
+    with SolutionCache() as cache:
+        for f in files:
+            process_batch(f, problems, baselines, out, cache, oracles, responses[f], verdicts)
 
     logging.info("Done.")
 
@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import logging
+from pathlib import Path
+
+from utils import read_problem_folder, read_metadata_folder
+from search import SOLVERS
+from stats import SearchStats
+from compiled import CompiledProblem, compile_record
+from baseline import schedule
+
+# The puzzle generators live next to the solvers in puzzle_generation/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "puzzle_generation"))
+from new_puzzles import SedPuzzleGenerator
+from binary_nfa_new import BinaryPuzzleGenerator
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+DEFAULT_BASELINE_PATH = Path("./data/benchmark_baseline.json")
+
+# Synthetic scaling sweeps: name -> (parameter values, generator of one puzzle per (index, value))
+SWEEPS = {
+    # Larger difficulties grow both the initial string and the rule set
+    "binary_difficulty": ((2, 4, 6, 8, 10), lambda i, d: BinaryPuzzleGenerator().generate_binary_puzzle(i, d)),
+    # Higher entropy grows the initial string and lets rules lengthen it
+    "sed_entropy": ((1, 2, 3, 4, 5, 6), lambda i, e: SedPuzzleGenerator().generate_puzzle(i, (e, 1, 2))),
+}
+
+
+def corpus_group(pid):
+    if pid.startswith("NFA_"):
+        return "NFA"
+    if pid.startswith("BIN_"):
+        return "BIN"
+    return "general"
+
+
+def profile_group(profile):
+    """Label of a difficulty profile, e.g. binary_only/difficulty=2 or entropy=1,branching=2,symbols=1"""
+    if not profile:
+        return "unknown"
+    kind = profile.get("type")
+    axes = ",".join(f"{k}={v}" for k, v in profile.items() if k != "type")
+    return f"{kind}/{axes}" if kind else axes
+
+
+def sweep_problems(sweep, per_point=5):
+    """Synthetic puzzles of one sweep, grouped by parameter value; the seed is fixed per point"""
+    values, generate = SWEEPS[sweep]
+    groups = {}
+    for value in values:
+        random.seed(f"{sweep}={value}")
+        problems = []
+        for i in range(per_point):
+            puzzle = generate(i, value)
+            if puzzle is not None:
+                problems.append(compile_record(puzzle[0]))
+        groups[f"sweep/{sweep}={value}"] = problems
+    return groups
+
+
+def benchmark_groups(per_point=5):
+    """Every benchmark group: the bundled corpus by family and by difficulty profile, then the sweeps"""
+    problems = read_problem_folder(compiled=True)
+    metadata = read_metadata_folder()
+    groups = {}
+    for pid, problem in sorted(problems.items()):
+        groups.setdefault(f"corpus/{corpus_group(pid)}", []).append(problem)
+        groups.setdefault(f"profile/{profile_group(metadata.get(pid))}", []).append(problem)
+    for sweep in SWEEPS:
+        groups.update(sweep_problems(sweep, per_point))
+    return groups
+
+
+def run_group(solve, problems, max_nodes):
+    """Solves every puzzle under the node budget alone, so counts are identical on every machine"""
+    totals = dict(puzzles=len(problems), solved=0, solution_steps=0, nodes_expanded=0,
+                  nodes_generated=0, peak_frontier=0, memory_growth_kb=0, elapsed=0.0)
+    for problem in problems:
+        stats = SearchStats()
+        solution = solve(problem, time_limit=math.inf, stats=stats, max_nodes=max_nodes)
+        if solution is not None:
+            totals["solved"] += 1
+            totals["solution_steps"] += len(solution)
+        totals["nodes_expanded"] += stats.nodes_expanded
+        totals["nodes_generated"] += stats.nodes_generated
+        totals["peak_frontier"] = max(totals["peak_frontier"], stats.peak_frontier)
+        totals["memory_growth_kb"] = max(totals["memory_growth_kb"], stats.memory_growth_kb)
+        totals["elapsed"] += stats.elapsed
+    totals["nodes_per_sec"] = totals["nodes_expanded"] / totals["elapsed"] if totals["elapsed"] > 0 else 0.0
+    return totals
+
+
+def overall(corpus):
+    """Throughput over the whole bundled corpus; single groups are too small to time reliably"""
+    nodes = sum(totals["nodes_expanded"] for totals in corpus)
+    elapsed = sum(totals["elapsed"] for totals in corpus)
+    return nodes / elapsed if elapsed > 0 else 0.0
+
+
+def compare(results, baseline, threshold, throughput_threshold):
+    """Lists every metric of results that is worse than the baseline by more than its threshold"""
+    regressions = []
+    for method, result in results.items():
+        previous = baseline.get(method, {}).get("nodes_per_sec")
+        if previous and result["nodes_per_sec"] < previous * (1 - throughput_threshold):
+            regressions.append(f"{method}: nodes_per_sec {previous:.0f} -> {result['nodes_per_sec']:.0f}")
+
+        for group, current in result["groups"].items():
+            previous = baseline.get(method, {}).get("groups", {}).get(group)
+            if previous is None:
+                continue
+            where = f"{method} {group}"
+            if current["solved"] < previous["solved"]:
+                regressions.append(f"{where}: solved {previous['solved']} -> {current['solved']}")
+            for metric in ("nodes_expanded", "peak_frontier"):
+                if current[metric] > previous[metric] * (1 + threshold):
+                    regressions.append(f"{where}: {metric} {previous[metric]} -> {current[metric]}")
+    return regressions
+
+
+# Deep, narrow puzzles: every layer holds one state, so the searches are as deep as max_nodes
+CHAINS = [
+    CompiledProblem("chain_grow", "a", ("ba", "a"), ("", "ac")),
+    CompiledProblem("chain_insert", "aaa", ("",), ("aaa",)),
+]
+# Puzzles whose nodes get costly to expand (backwards, here) as the search deepens
+COSTLY = [
+    CompiledProblem("costly_nodes", "cc", ("a", "c", ""), ("", "cc", "ac")),
+]
+
+
+def selftest(max_nodes=3000, time_limit=10, short_limit=0.5):
+    """
+    Quick solver regression checks. Returns the number of failed checks.
+
+    Every solver must finish each chain puzzle, or expand it to max_nodes, within
+    time_limit; a visited set that is rescanned per layer blows that up. Without a
+    node budget, every solver must also stop within 1.5 times short_limit on the
+    chain and costly puzzles, so the clock is read often enough however slow
+    single nodes or the steps between them get. The baseline must schedule
+    BIN_036, the slowest corpus puzzle, among its first jobs from its difficulty
+    profile alone.
+    """
+    failures = 0
+
+    def check(ok, what):
+        nonlocal failures
+        failures += not ok
+        print(f"  {'ok  ' if ok else 'FAIL'} {what}")
+
+    for problem in CHAINS:
+        for method, solve in SOLVERS.items():
+            stats = SearchStats()
+            start = time.time()
+            solve(problem, time_limit=time_limit, stats=stats, max_nodes=max_nodes)
+            elapsed = time.time() - start
+            check(stats.stop_reason != "time_limit" and elapsed < time_limit,
+                  f"{method} stops on {problem.problem_id} ({stats.stop_reason}, {stats.nodes_expanded} nodes) in {elapsed:.2f}s")
+
+    for problem in CHAINS + COSTLY:
+        for method, solve in SOLVERS.items():
+            start = time.time()
+            solve(problem, time_limit=short_limit)
+            elapsed = time.time() - start
+            check(elapsed < 1.5 * short_limit, f"{method} keeps a {short_limit}s limit on {problem.problem_id} ({elapsed:.2f}s)")
+    order = [p.problem_id for p in schedule(read_problem_folder(compiled=True).values(), read_metadata_folder())]
+    check("BIN_036" in order[:8], f"baseline schedules BIN_036 {order.index('BIN_036') + 1}th of {len(order)}")
+    print(f"Selftest: {'passed' if not failures else f'{failures} checks failed'}")
+    return failures
+
+
+def main(methods=None, max_nodes=20_000, per_point=5, baseline_path=DEFAULT_BASELINE_PATH, save=False,
+         threshold=0.1, throughput_threshold=0.3):
+    methods = methods or list(SOLVERS)
+    groups = benchmark_groups(per_point)
+
+    results = {}
+    for method in methods:
+        results[method] = {"groups": {}}
+        for group, problems in groups.items():
+            totals = run_group(SOLVERS[method], problems, max_nodes)
+            results[method]["groups"][group] = totals
+            logging.info(f"{method:>13} {group:<50} solved {totals['solved']:>3}/{totals['puzzles']:<3} "
+                         f"nodes {totals['nodes_expanded']:>9} {totals['nodes_per_sec']:>9.0f}/s "
+                         f"peak frontier {totals['peak_frontier']:>7}")
+        results[method]["nodes_per_sec"] = overall(
+            [totals for group, totals in results[method]["groups"].items() if group.startswith("corpus/")])
+        logging.info(f"{method:>13} corpus throughput {results[method]['nodes_per_sec']:.0f} nodes/s")
+
+    if save:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump({"max_nodes": max_nodes, "per_point": per_point, "results": results}, f, indent=2)
+        logging.info(f"Baseline written to {baseline_path}")
+        return 0
+
+    if not baseline_path.exists():
+        logging.info(f"No baseline at {baseline_path}; rerun with --save to record one")
+        return 0
+
+    baseline = json.loads(baseline_path.read_text())
+    if (baseline["max_nodes"], baseline["per_point"]) != (max_nodes, per_point):
+        logging.error(f"Baseline was recorded with max_nodes={baseline['max_nodes']}, per_point={baseline['per_point']}")
+        return 2
+
+    regressions = compare(results, baseline["results"], threshold, throughput_threshold)
+    for regression in regressions:
+        logging.error(f"REGRESSION {regression}")
+    logging.info(f"{len(regressions)} regressions against {baseline_path}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every solver on the puzzle corpus and synthetic sweeps")
+    parser.add_argument("--method", action="append", choices=sorted(SOLVERS), help="Solver to run (repeatable, defaults to all)")
+    parser.add_argument("--max_nodes", type=int, default=20_000, help="Node budget per puzzle")
+    parser.add_argument("--per_point", type=int, default=5, help="Synthetic puzzles per sweep value")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE_PATH, help="Baseline JSON to compare against")
+    parser.add_argument("--save", action="store_true", help="Record this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Allowed growth of node and frontier counts")
+    parser.add_argument("--throughput_threshold", type=float, default=0.3, help="Allowed drop in nodes per second")
+    parser.add_argument("--selftest", action="store_true", help="Run quick solver regression checks instead")
+    args = parser.parse_args()
+    if args.selftest:
+        sys.exit(selftest() > 0)
+    sys.exit(main(methods=args.method, max_nodes=args.max_nodes, per_point=args.per_point,
+                  baseline_path=args.baseline, save=args.save, threshold=args.threshold,
+                  throughput_threshold=args.throughput_threshold))
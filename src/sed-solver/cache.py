@@ -0,0 +1,125 @@
+import json
+import time
+import sqlite3
+import hashlib
+from pathlib import Path
+
+from stats import SearchStats
+from compiled import compile_problem
+
+DEFAULT_CACHE_PATH = Path("./data/cache/solutions.sqlite")
+
+
+def problem_key(problem):
+    """Canonical hash of what determines a puzzle's answer: its initial string and transitions"""
+    problem = compile_problem(problem)
+    canonical = json.dumps(
+        [problem.initial_string, [[src, tgt] for src, tgt in problem.rules()]],
+        separators=(",", ":"), ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class SolutionCache:
+    """
+    On-disk solution cache keyed by problem_key.
+
+    Each entry holds either a solution or an "unsolved" marker together with the
+    time budget that was tried, so a marker only answers lookups with the same or a
+    smaller budget. Entries are evicted least-recently-used once the cache holds more
+    than max_entries. Backed by SQLite in WAL mode, so several processes can share
+    one cache file.
+    """
+
+    EVICT_EVERY = 256  # Check the size limit once per this many writes
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=100_000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.writes = 0
+
+        self.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS solutions ("
+            "key TEXT PRIMARY KEY, solution TEXT, length INTEGER, "
+            "budget REAL, method TEXT, last_used REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS solutions_last_used ON solutions (last_used)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def lookup(self, problem, time_limit):
+        """
+        Returns (hit, solution). On a hit, solution is the cached index list, or None
+        if the puzzle is known to be unsolvable within time_limit.
+        """
+        key = problem_key(problem)
+        row = self.db.execute("SELECT solution, budget FROM solutions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None
+
+        solution, budget = row
+        if solution is None and budget < time_limit:
+            return False, None  # Only failed under a smaller budget, worth retrying
+
+        self.db.execute("UPDATE solutions SET last_used = ? WHERE key = ?", (time.time(), key))
+        return True, None if solution is None else json.loads(solution)
+
+    def store(self, problem, solution, time_limit, method="bfs"):
+        key = problem_key(problem)
+        if solution is None:
+            # Never let a failure overwrite a known solution or a larger failed budget
+            self.db.execute(
+                "INSERT INTO solutions VALUES (?, NULL, NULL, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET budget = MAX(budget, excluded.budget), last_used = excluded.last_used "
+                "WHERE solution IS NULL",
+                (key, time_limit, method, time.time()),
+            )
+        else:
+            self.db.execute(
+                "INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?, ?, ?)",
+                (key, json.dumps(solution), len(solution), time_limit, method, time.time()),
+            )
+
+        self.writes += 1
+        if self.writes % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Drops the least recently used entries beyond max_entries"""
+        self.db.execute(
+            "DELETE FROM solutions WHERE key IN "
+            "(SELECT key FROM solutions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+
+def solve_cached(problem, solve, time_limit=5, cache=None, method="bfs", stats=None, max_nodes=None):
+    """
+    Runs solve(problem, time_limit=...) unless the cache already knows the answer.
+    stats and max_nodes are passed through to the solver; a hit is recorded as "cached".
+    """
+    if cache is None:
+        return solve(problem, time_limit=time_limit, stats=stats, max_nodes=max_nodes)
+
+    hit, solution = cache.lookup(problem, time_limit)
+    if hit:
+        if stats is not None:
+            stats.stop_reason = "cached"
+        return solution
+
+    stats = stats if stats is not None else SearchStats()
+    solution = solve(problem, time_limit=time_limit, stats=stats, max_nodes=max_nodes)
+    # A failure under a node budget says nothing about the time budget the cache is keyed on
+    if solution is not None or stats.stop_reason != "node_limit":
+        cache.store(problem, solution, time_limit, method)
+    return solution
@@ -0,0 +1,54 @@
+from typing import NamedTuple, Tuple
+
+
+class CompiledProblem(NamedTuple):
+    """
+    Immutable, tuple-backed puzzle that solvers and verifiers run on.
+
+    schema.Problem stays the validated I/O model; this drops the per-transition
+    pydantic objects in favour of parallel tuples of srcs and tgts, which are
+    cheaper to build, pickle to worker processes, and read.
+    """
+    problem_id: str
+    initial_string: str
+    srcs: Tuple[str, ...]
+    tgts: Tuple[str, ...]
+
+    def rules(self):
+        """(src, tgt) of every transition, in index order"""
+        return zip(self.srcs, self.tgts)
+
+
+def compile_problem(problem) -> CompiledProblem:
+    """Compiles a validated schema.Problem; a CompiledProblem passes through unchanged"""
+    if isinstance(problem, CompiledProblem):
+        return problem
+    transitions = problem.transitions
+    return CompiledProblem(problem.problem_id, problem.initial_string,
+                           tuple(t.src for t in transitions), tuple(t.tgt for t in transitions))
+
+
+def compile_record(data) -> CompiledProblem:
+    """
+    Compiles a problem straight from its parsed JSON, for loading large corpora.
+    Applies the same checks as schema.Problem and schema.Transition, raising
+    ValueError where they would raise a ValidationError.
+    """
+    problem_id, initial, transitions = data["problem_id"], data["initial_string"], data["transitions"]
+    if not isinstance(problem_id, str) or not isinstance(initial, str) or not isinstance(transitions, list):
+        raise ValueError("problem_id and initial_string must be strings and transitions a list")
+    if not transitions:
+        raise ValueError("Transitions list is empty")
+    if not initial:
+        raise ValueError("Initial string is empty")
+
+    srcs, tgts = [], []
+    for t in transitions:
+        src, tgt = t["src"], t["tgt"]
+        if not isinstance(src, str) or not isinstance(tgt, str):
+            raise ValueError("Transition src and tgt must be strings")
+        if not src and not tgt:
+            raise ValueError("Transition is empty")
+        srcs.append(src)
+        tgts.append(tgt)
+    return CompiledProblem(problem_id, initial, tuple(srcs), tuple(tgts))
@@ -0,0 +1,212 @@
+import os
+import mmap
+import json
+import struct
+import argparse
+import logging
+from bisect import bisect_left
+from pathlib import Path
+
+MAGIC = b"SEDPACK1"
+HEADER = struct.Struct("<8sQQQ")  # magic, record count, index offset, id blob offset
+ENTRY = struct.Struct("<QIQH")  # record offset, record length, id offset, id length
+
+
+class PackedCorpus:
+    """
+    Read-only view of a packed corpus file.
+
+    The file holds one compact JSON record per line, followed by a fixed-width
+    index sorted by id and a blob of the ids themselves. Only the header is
+    read on open; the rest is memory-mapped, so a lookup by id is a binary
+    search over the index and parses just the record it finds.
+
+        header | records (one JSON line each) | index entries | ids
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.file = open(self.path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.index_offset, self.ids_offset = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a packed corpus")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.count
+
+    def _entry(self, i):
+        return ENTRY.unpack_from(self.data, self.index_offset + i * ENTRY.size)
+
+    def _id(self, i):
+        _, _, id_offset, id_length = self._entry(i)
+        start = self.ids_offset + id_offset
+        return self.data[start:start + id_length].decode()
+
+    def _find(self, key):
+        # bisect over a lazily decoded view of the sorted ids
+        i = bisect_left(_IdView(self), key)
+        return i if i < self.count and self._id(i) == key else None
+
+    def _record(self, i):
+        offset, length, _, _ = self._entry(i)
+        return json.loads(self.data[offset:offset + length])
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i is None:
+            raise KeyError(key)
+        return self._record(i)
+
+    def get(self, key, default=None):
+        i = self._find(key)
+        return default if i is None else self._record(i)
+
+    def ids(self):
+        return [self._id(i) for i in range(self.count)]
+
+    def items(self):
+        """Streams (id, record) pairs in id order"""
+        for i in range(self.count):
+            yield self._id(i), self._record(i)
+
+
+class _IdView:
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def __len__(self):
+        return self.corpus.count
+
+    def __getitem__(self, i):
+        return self.corpus._id(i)
+
+
+class FolderCorpus:
+    """The one-JSON-file-per-record folder layout behind the PackedCorpus interface"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    def __len__(self):
+        return len(self.ids())
+
+    def __contains__(self, key):
+        return (self.path / f"{key}.json").is_file()
+
+    def __getitem__(self, key):
+        try:
+            return json.loads((self.path / f"{key}.json").read_text())
+        except FileNotFoundError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def ids(self):
+        return sorted(name[:-len(".json")] for name in os.listdir(self.path) if name.endswith(".json"))
+
+    def items(self):
+        for key in self.ids():
+            yield key, self[key]
+
+
+def is_packed(path):
+    path = Path(path)
+    if not path.is_file():
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def open_corpus(path):
+    """Opens a packed corpus file or a folder of JSON files; both support ids, lookup by id and items"""
+    return PackedCorpus(path) if is_packed(path) else FolderCorpus(path)
+
+
+def write_pack(path, items):
+    """Writes (id, record) pairs to a packed corpus file, streaming the records"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    entries = []
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 0, 0, 0))
+        for key, record in items:
+            line = json.dumps(record, separators=(",", ":"), ensure_ascii=False).encode()
+            entries.append((key, f.tell(), len(line)))
+            f.write(line + b"\n")
+
+        entries.sort()
+        index_offset = f.tell()
+        id_offset = 0
+        encoded = []
+        for key, offset, length in entries:
+            key = key.encode()
+            f.write(ENTRY.pack(offset, length, id_offset, len(key)))
+            encoded.append(key)
+            id_offset += len(key)
+        ids_offset = f.tell()
+        f.write(b"".join(encoded))
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(entries), index_offset, ids_offset))
+    return len(entries)
+
+
+def pack_folder(folder, path):
+    """Converts a folder of JSON files into a packed corpus file keyed by file stem"""
+    with FolderCorpus(folder) as corpus:
+        return write_pack(path, corpus.items())
+
+
+def unpack_folder(path, folder):
+    """Converts a packed corpus file back into one pretty-printed JSON file per record"""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with PackedCorpus(path) as corpus:
+        for key, record in corpus.items():
+            with open(folder / f"{key}.json", "w") as f:
+                json.dump(record, f, indent=2)
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description="Convert between JSON folders and packed corpus files")
+    parser.add_argument("command", choices=["pack", "unpack"])
+    parser.add_argument("source", type=Path, help="Folder to pack, or packed file to unpack")
+    parser.add_argument("target", type=Path, help="Packed file to write, or folder to unpack into")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        count = pack_folder(args.source, args.target)
+    else:
+        count = unpack_folder(args.source, args.target)
+    logging.info(f"Converted {count} records from {args.source} to {args.target}")
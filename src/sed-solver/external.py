@@ -0,0 +1,230 @@
+import os
+import heapq
+import tempfile
+from itertools import count, groupby
+
+from matcher import RuleMatcher, reaches_goal
+from stats import Budget
+from compiled import compile_problem
+
+# A visited file is binary-searched rather than streamed once it holds this many
+# keys per child of the layer being deduplicated
+PROBE_RATIO = 64
+
+
+def escape(state):
+    # Keeps every record on one tab-separated line; comparisons only ever happen
+    # between escaped keys, so sort order and equality stay consistent
+    return state.encode("unicode_escape").decode("ascii")
+
+
+def unescape(key):
+    return key.encode("ascii").decode("unicode_escape")
+
+
+def write_records(path, records):
+    """Writes (key, parent key, rule) records, one per line"""
+    count = 0
+    with open(path, "w") as f:
+        for key, parent, rule in records:
+            f.write(f"{key}\t{parent}\t{rule}\n")
+            count += 1
+    return count
+
+
+def read_records(path):
+    with open(path) as f:
+        for line in f:
+            key, parent, rule = line.rstrip("\n").split("\t")
+            yield key, parent, int(rule)
+
+
+def read_keys(f):
+    """Keys of a layer file or a merged visited file opened in binary mode, from the start"""
+    f.seek(0)
+    for line in f:
+        yield line.split(b"\t", 1)[0].rstrip(b"\n").decode("ascii")
+
+
+def write_keys(path, keys):
+    with open(path, "w") as f:
+        for key in keys:
+            f.write(f"{key}\n")
+
+
+def contains(f, size, key):
+    """True if key is the key of a line in f, a sorted key or layer file opened in binary mode"""
+    key = key.encode("ascii")
+
+    def key_after(offset):
+        # Key of the first line starting after offset (at it, for offset 0); None past the end
+        f.seek(offset)
+        if offset:
+            f.readline()
+        line = f.readline()
+        return line.split(b"\t", 1)[0].rstrip(b"\n") if line else None
+
+    # Smallest offset whose following line holds a key >= key; that line is the only candidate
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        found = key_after(mid)
+        if found is None or found >= key:
+            hi = mid
+        else:
+            lo = mid + 1
+    return key_after(lo) == key
+
+
+def probe(candidates, f):
+    """Drops candidates whose key occurs in the sorted file f, looking each one up"""
+    size = os.fstat(f.fileno()).st_size
+    for record in candidates:
+        if not contains(f, size, record[0]):
+            yield record
+
+
+def subtract(candidates, seen):
+    """Drops candidates whose key occurs in seen; both streams must be sorted by key"""
+    seen = iter(seen)
+    current = next(seen, None)
+    for record in candidates:
+        while current is not None and current < record[0]:
+            current = next(seen, None)
+        if current != record[0]:
+            yield record
+
+
+def external_bfs(problem, time_limit=5, workdir=None, buffer_size=1_000_000, stats=None, max_nodes=None):
+    """
+    Breadth-first search whose visited set lives on disk.
+
+    Every layer is stored as a file of (state, parent, rule) records sorted by state.
+    Children of the current layer are collected in an in-memory buffer of at most
+    buffer_size records, spilled to sorted run files, then merged, deduplicated, and
+    subtracted from the visited set before being written out as the next layer.
+    The solution is traced back through the layer files once the null string appears.
+
+    The newest layers are also kept as an in-memory set of at most buffer_size
+    states. Once the next layer would not fit, the set is written out to the
+    visited files, a few sorted files whose sizes at least double from the newest
+    to the oldest; each new file is merged into the one before it while that one is
+    no larger. Children are subtracted from each file with a streaming merge, or by
+    binary search when the file is much larger than the layer, so a deep, narrow
+    search never rereads everything it has seen.
+    """
+    problem = compile_problem(problem)
+    matcher = RuleMatcher.from_problem(problem)
+    initial = problem.initial_string
+    goal = escape("")
+    budget = Budget(time_limit, max_nodes)
+    expanded = generated = admitted = 0
+    peak_frontier = 1
+    solution, reason = None, "exhausted"
+
+    if initial == "":
+        solution, reason = [], "solved"
+
+    with tempfile.TemporaryDirectory(prefix="sed-bfs-", dir=workdir) as tmp:
+        layers = [os.path.join(tmp, "layer_0000.tsv")]
+        layer_size = write_records(layers[0], [(escape(initial), "", -1)])
+        recent = set()  # keys of the newest layers, while they fit in buffer_size
+        visited = []  # (path, keys, open file) of every visited file, oldest and largest first
+        file_ids = count()
+
+        def add_visited(path, keys):
+            visited.append((path, keys, open(path, "rb")))
+            while len(visited) > 1 and visited[-2][1] <= visited[-1][1]:
+                (older, older_keys, older_file), (newer, newer_keys, newer_file) = visited[-2:]
+                merged_path = os.path.join(tmp, f"visited_{next(file_ids):04d}.txt")
+                write_keys(merged_path, heapq.merge(read_keys(older_file), read_keys(newer_file)))
+                for done, done_file in ((older, older_file), (newer, newer_file)):
+                    done_file.close()
+                    if os.path.basename(done).startswith("visited_"):
+                        os.remove(done)
+                visited[-2:] = [(merged_path, older_keys + newer_keys, open(merged_path, "rb"))]
+
+        try:
+            while reason == "exhausted":
+                # Keep the layer's states in memory if they fit, writing out older ones to make room
+                if len(recent) + layer_size > buffer_size:
+                    if recent:
+                        path = os.path.join(tmp, f"visited_{next(file_ids):04d}.txt")
+                        write_keys(path, sorted(recent))
+                        add_visited(path, len(recent))
+                        recent = set()
+                    if layer_size > buffer_size:
+                        add_visited(layers[-1], layer_size)
+                keep = layer_size <= buffer_size
+
+                # Expand the last layer into sorted runs
+                runs, buffer = [], []
+                layer_start = generated
+                for key, _, _ in read_records(layers[-1]):
+                    if key == goal:
+                        # The null string sorts first, so it can only be the first record
+                        reason = "solved"
+                        break
+                    reason = budget.spent(expanded) or "exhausted"
+                    if reason != "exhausted":
+                        break
+                    expanded += 1
+                    if keep:
+                        recent.add(key)
+
+                    for i, new_string in matcher.successors(unescape(key)):
+                        buffer.append((escape(new_string), key, i))
+                        generated += 1
+                    if len(buffer) >= buffer_size:
+                        runs.append(os.path.join(tmp, f"run_{len(runs):04d}.tsv"))
+                        write_records(runs[-1], sorted(buffer))
+                        buffer = []
+                if reason != "exhausted":
+                    break
+                children = generated - layer_start
+                if runs and buffer:
+                    runs.append(os.path.join(tmp, f"run_{len(runs):04d}.tsv"))
+                    write_records(runs[-1], sorted(buffer))
+                    buffer = []
+
+                # Merge the runs, keep one record per state and drop states seen in earlier layers
+                merged = heapq.merge(*(read_records(run) for run in runs)) if runs else sorted(buffer)
+                unique = (next(group) for _, group in groupby(merged, key=lambda record: record[0]))
+                unique = (record for record in unique if record[0] not in recent)
+                for _, keys, seen in visited:
+                    if keys >= PROBE_RATIO * children:
+                        unique = probe(unique, seen)
+                    else:
+                        unique = subtract(unique, read_keys(seen))
+                path = os.path.join(tmp, f"layer_{len(layers):04d}.tsv")
+                layer_size = write_records(path, unique)
+                for run in runs:
+                    os.remove(run)
+
+                if layer_size == 0:
+                    break  # No solution found
+                layers.append(path)
+                admitted += layer_size
+                peak_frontier = max(peak_frontier, layer_size)
+        finally:
+            for _, _, seen in visited:
+                seen.close()
+
+        if reason == "solved" and solution is None:
+            # Walk the parent links back through the layer files
+            solution = []
+            key = goal
+            for layer in reversed(layers[1:]):
+                for record_key, parent, rule in read_records(layer):
+                    if record_key == key:
+                        solution.append(rule)
+                        key = parent
+                        break
+            solution.reverse()
+
+            if not reaches_goal(matcher, initial, solution):
+                raise RuntimeError(f"External-memory search built an invalid solution for {problem.problem_id}")
+
+    if stats is not None:
+        stats.finish(reason, budget, expanded, generated, generated - admitted, peak_frontier)
+    return solution
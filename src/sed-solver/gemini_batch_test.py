@@ -1,9 +1,12 @@
-import os, json, random
+import os, re, sys, json, random, asyncio, hashlib, argparse, tempfile
+from types import SimpleNamespace
+from functools import lru_cache
 from dotenv import load_dotenv
-from google import genai
 
-load_dotenv()
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+from corpus import open_corpus
+from batch_response_parser import parse_batch_response_text
+from prompting import PromptTemplate, PrefillStats, split_label
+
 MODEL = "gemini-2.5-flash-lite"
 
 PROMPTS = "./prompts/base_prompts"
@@ -15,9 +18,25 @@ PROMPT_METHODS = {
     "cot": os.path.join(PROMPTS, "CoT_prompt.md"),
     "few_shot": os.path.join(PROMPTS, "few_shot_prompt.md"),
     "few_shot_cot": os.path.join(PROMPTS, "Fewshot_CoT.md"),
-    "markov": os.path("./prompts/base_prompts/smaller_prompts/markov.md")
+    "markov": os.path.join("./prompts/smaller_prompts", "markov.md"),
 }
 
+# Chunking and submission limits
+CHARS_PER_TOKEN = 4  # rough estimate; avoids a count_tokens round trip per chunk
+TOKEN_BUDGET = 16_000  # prompt tokens per chunk
+MAX_PROBLEMS_PER_CHUNK = 10  # keeps each answer well inside the output limit
+CONCURRENCY = 4
+REQUESTS_PER_MINUTE = 15
+MAX_RETRIES = 3
+BACKOFF_BASE = 2.0  # seconds before the first retry, doubled on every further one
+
+
+def make_client():
+    from google import genai
+
+    load_dotenv()
+    return genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+
 def load_json(p):
     with open(p) as f:
         return json.load(f)
@@ -26,41 +45,139 @@ def load_text(p):
     with open(p) as f:
         return f.read()
 
-def sample_problems(n=50):
-    files = [os.path.join(PROBLEMS, f) for f in os.listdir(PROBLEMS) if f.endswith(".json")]
-    return random.sample(files, min(n, len(files)))
+def sample_problems(n=50, seed=None):
+    with open_corpus(PROBLEMS) as corpus:
+        ids = corpus.ids()
+        ids = random.Random(seed).sample(ids, min(n, len(ids)))
+        return [corpus[pid] for pid in ids]
 
-def create_batch_prompt(template, problems):
-    base_template = template.split("## Task")[0] + "## Task\n\n"
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def problem_block(i, total, prob):
+    return f"--- PROBLEM {i}/{total} ---\n```json\n{json.dumps(prob, indent=2)}\n```\n\n"
+
+@lru_cache(maxsize=None)
+def batch_prefix(template):
+    """Static start of every batch prompt for a template, identical across chunks so Gemini can cache it"""
+    if "## Task" in template:
+        base_template = template.split("## Task")[0]
+    else:
+        # Keep the instructions, minus the line that introduced the single problem
+        base_template = split_label(PromptTemplate(template).prefix)[0].rstrip("\n") + "\n\n"
+    base_template += "## Task\n\n"
     base_template += "Solve ALL of the following problems. For each problem, provide the solution in the format specified above.\n\n"
     base_template += "Process these problems one by one:\n\n"
+    return base_template
 
-    # Add all problems
-    for i, prob in enumerate(problems, 1):
-        base_template += f"--- PROBLEM {i}/{len(problems)} ---\n"
-        base_template += f"```json\n{json.dumps(prob, indent=2)}\n```\n\n"
+def create_batch_prompt(template, problems):
+    # Add all problems after the shared prefix
+    blocks = [problem_block(i, len(problems), prob) for i, prob in enumerate(problems, 1)]
+    return batch_prefix(template) + "".join(blocks) + "Now provide solutions for ALL problems above. Clearly separate each solution."
 
-    base_template += "Now provide solutions for ALL problems above. Clearly separate each solution."
-    return base_template
+def chunk_problems(template, problems, token_budget=TOKEN_BUDGET, max_problems=MAX_PROBLEMS_PER_CHUNK):
+    """Splits problems into consecutive chunks whose batch prompt fits token_budget (always at least one problem)"""
+    overhead = estimate_tokens(create_batch_prompt(template, []))
+    chunks, current, used = [], [], overhead
+    for prob in problems:
+        cost = estimate_tokens(problem_block(max_problems, max_problems, prob))
+        if current and (used + cost > token_budget or len(current) == max_problems):
+            chunks.append(current)
+            current, used = [], overhead
+        current.append(prob)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class RateLimiter:
+    """Spaces request starts at least 60 / requests_per_minute seconds apart"""
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE):
+        self.interval = 60 / requests_per_minute
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            delay = self.next_start - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_start = max(loop.time(), self.next_start) + self.interval
+
+
+def missing_solutions(text, problem_ids):
+    """Problem ids of the chunk that have no parsable answer in its response"""
+    answered = {str(d["problem_id"]) for d in parse_batch_response_text(text)}
+    return [pid for pid in problem_ids if pid not in answered]
+
+
+async def prompt_gemini(client, text, limiter, semaphore, problem_ids, retries=MAX_RETRIES, stats=None, backoff=BACKOFF_BASE):
+    """
+    Sends one chunk, retrying it alone when the request fails or the answer is
+    truncated (some problem has no parsable solution). Returns the best response seen.
+    """
+    best, best_missing = None, None
+    for attempt in range(retries + 1):
+        async with semaphore:
+            await limiter.wait()
+            try:
+                r = await client.aio.models.generate_content(model=MODEL, contents=text)
+                response = r.text or ""
+                usage = getattr(r, "usage_metadata", None)
+                if stats is not None and usage is not None:
+                    stats.record(usage.prompt_token_count, usage.cached_content_token_count)
+            except Exception as e:
+                response = f"ERROR: {e}"
 
-def prompt_gemini(text):
-    try:
-        r = client.models.generate_content(
-            model=MODEL,
-            contents=text,
-        )
-        return r.text
-    except Exception as e:
-        return f"ERROR: {e}"
-
-def save_batch(method, text, problem_ids):
-    d = os.path.join(OUT, method)
+        missing = missing_solutions(response, problem_ids)
+        if best is None or len(missing) < len(best_missing):
+            best, best_missing = response, missing
+        if not missing:
+            break
+        if attempt < retries:
+            print(f"  Chunk {problem_ids[0]}..{problem_ids[-1]} missing {len(missing)} answers, retrying")
+            await asyncio.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+    return best, best_missing
+
+def chunk_path(method, prompt, out=OUT):
+    # Content-addressed, so a rerun over the same sample only resubmits chunks without a saved response
+    key = hashlib.sha256(f"{MODEL}\n{prompt}".encode()).hexdigest()[:16]
+    return os.path.join(out, method, "chunks", f"{key}.txt")
+
+async def run_method(client, method, template, problems, limiter, semaphore, token_budget, retries, stats, out, backoff):
+    chunks = chunk_problems(template, problems, token_budget)
+    print(f"{method}: {len(problems)} problems in {len(chunks)} chunks")
+
+    async def run_chunk(chunk):
+        prompt = create_batch_prompt(template, chunk)
+        path = chunk_path(method, prompt, out)
+        problem_ids = [p["problem_id"] for p in chunk]
+        if os.path.exists(path):
+            return load_text(path), missing_solutions(load_text(path), problem_ids)
+
+        response, missing = await prompt_gemini(client, prompt, limiter, semaphore, problem_ids, retries, stats, backoff)
+        if not missing:
+            # Only complete answers are kept, so a rerun retries the rest
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(response)
+        return response, missing
+
+    results = await asyncio.gather(*(run_chunk(chunk) for chunk in chunks))
+    save_batch(method, [response for response, _ in results], [p["problem_id"] for p in problems],
+               sorted(pid for _, missing in results for pid in missing), out)
+
+def save_batch(method, responses, problem_ids, missing, out=OUT):
+    d = os.path.join(out, method)
     os.makedirs(d, exist_ok=True)
 
-    # Save full response
-    path = os.path.join(d, "batch_response_all_50.txt")
+    # Merge the chunk responses into the one file batch_response_parser reads
+    path = os.path.join(d, f"batch_response_all_{len(problem_ids)}.txt")
     with open(path, "w") as f:
-        f.write(text)
+        f.write("\n\n".join(responses))
     print(f"  Saved: {path}")
 
     # Save metadata about which problems were included
@@ -68,48 +185,134 @@ def save_batch(method, text, problem_ids):
     with open(meta_path, "w") as f:
         json.dump({
             "num_problems": len(problem_ids),
-            "problem_ids": problem_ids
+            "problem_ids": problem_ids,
+            "num_chunks": len(responses),
+            "missing_problem_ids": missing,
         }, f, indent=2)
     print(f"  Saved metadata: {meta_path}")
 
-# --- Main ---
-def main():
-    # Sample 50 problems
-    problem_files = sample_problems(50)
-    problems = [load_json(pf) for pf in problem_files]
-    problem_ids = [p["problem_id"] for p in problems]
+async def run_batches(client, problems, methods=tuple(PROMPT_METHODS), token_budget=TOKEN_BUDGET,
+                      concurrency=CONCURRENCY, requests_per_minute=REQUESTS_PER_MINUTE, retries=MAX_RETRIES,
+                      out=OUT, backoff=BACKOFF_BASE):
+    # One limiter and semaphore shared by every method, since they share the API quota
+    limiter = RateLimiter(requests_per_minute)
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = PrefillStats()
+    await asyncio.gather(*(
+        run_method(client, method, load_text(PROMPT_METHODS[method]), problems, limiter, semaphore, token_budget, retries, stats, out, backoff)
+        for method in methods
+    ))
+    print(f"Prefill: {stats}")
 
-    print(f"Sampled {len(problems)} problems")
-    print(f"Problem IDs: {', '.join(problem_ids[:10])}... (showing first 10)")
-    print(f"\nSending 3 batch requests (1 per method)\n")
+class StubClient:
+    """
+    Stand-in for genai.Client, so the scheduler can be checked offline.
 
-    for method, prompt_file in PROMPT_METHODS.items():
-        print(f"\n{'='*80}")
-        print(f"METHOD: {method.upper()}")
-        print(f"{'='*80}")
+    Every problem after the prompt's "## Task" heading gets a solution block.
+    script maps the first problem id of a chunk to what its successive attempts
+    do: "error" raises, "truncate" drops the second half of the answers, and
+    "ok" (also once the script runs out) answers in full. Earlier requests take
+    longer, so chunks finish out of order.
+    """
 
-        # Load template
-        template = load_text(prompt_file)
+    def __init__(self, script=None, delay=0.05):
+        self.script = {pid: list(steps) for pid, steps in (script or {}).items()}
+        self.delay = delay
+        self.started, self.finished = [], []
+        self.aio = SimpleNamespace(models=self)
 
-        # Create batch prompt with all 50 problems
-        print(f"Creating batch prompt with {len(problems)} problems...")
-        batch_prompt = create_batch_prompt(template, problems)
+    async def generate_content(self, model, contents):
+        ids = re.findall(r'"problem_id": "([^"]+)"', contents.split("## Task")[-1])
+        self.started.append(ids[0])
+        steps = self.script.get(ids[0])
+        action = steps.pop(0) if steps else "ok"
+        await asyncio.sleep(self.delay / len(self.started))
+        self.finished.append(ids[0])
+        if action == "error":
+            raise RuntimeError("503 Service Unavailable")
+        if action == "truncate":
+            ids = ids[:len(ids) // 2]
+        text = "\n\n".join(f"```json\n{json.dumps({'problem_id': pid, 'solution': [0]})}\n```" for pid in ids)
+        usage = SimpleNamespace(prompt_token_count=estimate_tokens(contents), cached_content_token_count=0)
+        return SimpleNamespace(text=text, usage_metadata=usage)
 
-        print(f"Prompt size: {len(batch_prompt):,} characters")
-        print(f"Sending to Gemini ({MODEL})...")
 
-        # Get response for all problems in one request
-        response = prompt_gemini(batch_prompt)
+def selftest(method="cot", n=40, seed=0):
+    """
+    Runs one method against StubClient in a temporary output folder and checks
+    that a failed and a truncated chunk are retried, that a chunk truncated on
+    every attempt is reported missing and resubmitted alone on a rerun, and that
+    the merged file keeps the sampled order although chunks finish out of order.
+    Returns the number of failed checks.
+    """
+    problems = sample_problems(n, seed)
+    template = load_text(PROMPT_METHODS[method])
+    chunks = chunk_problems(template, problems)
+    firsts = [chunk[0]["problem_id"] for chunk in chunks]
+    retries = 2
+    script = {firsts[0]: ["error"], firsts[1]: ["truncate"], firsts[-1]: ["truncate"] * (retries + 1)}
+    lost = [p["problem_id"] for p in chunks[-1]]
+    lost = lost[len(lost) // 2:]
+    failures = 0
 
-        # Save the batch response
-        save_batch(method, response, problem_ids)
+    def check(ok, what):
+        nonlocal failures
+        failures += not ok
+        print(f"  {'ok  ' if ok else 'FAIL'} {what}")
+
+    with tempfile.TemporaryDirectory() as out:
+        def run(client):
+            asyncio.run(run_batches(client, problems, (method,), concurrency=len(chunks), requests_per_minute=60_000,
+                                    retries=retries, out=out, backoff=0.01))
+            meta = load_json(os.path.join(out, method, "batch_metadata.json"))
+            merged = parse_batch_response_text(load_text(os.path.join(out, method, f"batch_response_all_{n}.txt")))
+            return meta, [str(d["problem_id"]) for d in merged]
+
+        client = StubClient(script)
+        meta, merged = run(client)
+        check(len(chunks) >= 4, f"{len(problems)} problems split into {len(chunks)} chunks")
+        check(client.started.count(firsts[0]) == 2, "failed request retried once")
+        check(client.started.count(firsts[1]) == 2, "truncated answer retried once")
+        check(client.started.count(firsts[-1]) == retries + 1, f"always truncated chunk tried {retries + 1} times")
+        check(meta["missing_problem_ids"] == sorted(lost), f"{len(lost)} unanswered problems reported missing")
+        check(client.finished[:len(chunks)] != client.started[:len(chunks)], "chunks finished out of order")
+        check(merged == [p["problem_id"] for p in problems if p["problem_id"] not in lost], "merged answers in sampled order")
+
+        rerun = StubClient()
+        meta, merged = run(rerun)
+        check(rerun.started == [firsts[-1]], "rerun resubmits only the incomplete chunk")
+        check(not meta["missing_problem_ids"] and merged == [p["problem_id"] for p in problems],
+              "rerun merges every answer in sampled order")
+    print(f"Selftest: {'passed' if not failures else f'{failures} checks failed'}")
+    return failures
+
+# --- Main ---
+def main(n=50, seed=None, methods=tuple(PROMPT_METHODS), client=None, **kwargs):
+    problems = sample_problems(n, seed)
+    problem_ids = [p["problem_id"] for p in problems]
+
+    print(f"Sampled {len(problems)} problems")
+    print(f"Problem IDs: {', '.join(problem_ids[:10])}... (showing first 10)")
 
-        print(f"✓ Completed {method}")
+    asyncio.run(run_batches(client or make_client(), problems, methods, **kwargs))
 
     print(f"\n{'='*80}")
-    print(f"DONE! All 3 batch requests completed.")
-    print(f"Outputs saved to: {OUT}")
+    print(f"DONE! Outputs saved to: {OUT}")
     print(f"{'='*80}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Send sampled problems to Gemini in token-budgeted chunks")
+    parser.add_argument("--num_problems", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=None, help="Fix the sample so a rerun resumes unfinished chunks")
+    parser.add_argument("--method", action="append", choices=sorted(PROMPT_METHODS), help="Prompt method (repeatable, defaults to all)")
+    parser.add_argument("--token_budget", type=int, default=TOKEN_BUDGET, help="Estimated prompt tokens per chunk")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Chunks in flight")
+    parser.add_argument("--rpm", type=float, default=REQUESTS_PER_MINUTE, help="Requests per minute")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES)
+    parser.add_argument("--selftest", action="store_true", help="Check chunk retries, truncation and merge order against a stub client")
+    args = parser.parse_args()
+    if args.selftest:
+        sys.exit(selftest(method=(args.method or ["cot"])[0]) > 0)
+    main(n=args.num_problems, seed=args.seed, methods=args.method or tuple(PROMPT_METHODS),
+         token_budget=args.token_budget, concurrency=args.concurrency,
+         requests_per_minute=args.rpm, retries=args.retries)
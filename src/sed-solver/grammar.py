@@ -0,0 +1,20 @@
+import json
+
+
+def gbnf_literal(text):
+    """text as a GBNF string literal"""
+    escaped = text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'"{escaped}"'
+
+
+def solution_grammar(problem):
+    """
+    GBNF grammar (llama.cpp "grammar" field) that only admits this problem's answer
+    in the form batch_response_parser reads: one ```json block holding its
+    problem_id and a non-empty solution array of indices in [0, len(transitions)).
+    """
+    head = "```json\n" + json.dumps({"problem_id": problem["problem_id"]})[:-1] + ', "solution": ['
+    tail = "]}\n```"
+    indices = " | ".join(f'"{i}"' for i in range(len(problem["transitions"])))
+    return (f"root ::= {gbnf_literal(head)} index ({gbnf_literal(', ')} index)* {gbnf_literal(tail)}\n"
+            f"index ::= {indices}\n")
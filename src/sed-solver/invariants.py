@@ -0,0 +1,127 @@
+import math
+from fractions import Fraction
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+
+from compiled import compile_problem
+
+EPS = 1e-9
+
+
+class Certificate(NamedTuple):
+    """Proof that a puzzle can never reach the null string"""
+    reason: str
+    weights: Dict[str, int]  # symbol weights whose weighted count never decreases
+
+    def __str__(self):
+        return self.reason
+
+
+def symbol_counts(string, symbols):
+    return [string.count(ch) for ch in symbols]
+
+
+def _simplex_max(c, A, b):
+    """Maximises c @ x subject to A @ x <= b and x >= 0, for b >= 0, using Bland's rule"""
+    m, n = A.shape
+    tableau = np.zeros((m + 1, n + m + 1))
+    tableau[:m, :n] = A
+    tableau[:m, n:n + m] = np.eye(m)
+    tableau[:m, -1] = b
+    tableau[-1, :n] = -c
+    basis = list(range(n, n + m))
+
+    while True:
+        entering = np.flatnonzero(tableau[-1, :-1] < -EPS)
+        if not len(entering):
+            break
+        col = entering[0]
+
+        column = tableau[:m, col]
+        rows = np.flatnonzero(column > EPS)
+        if not len(rows):
+            return None  # Unbounded
+        ratios = tableau[rows, -1] / column[rows]
+        ties = rows[ratios <= ratios.min() + EPS]
+        row = min(ties, key=lambda r: basis[r])
+
+        tableau[row] /= tableau[row, col]
+        for r in range(m + 1):
+            if r != row and abs(tableau[r, col]) > EPS:
+                tableau[r] -= tableau[r, col] * tableau[row]
+        basis[row] = col
+
+    x = np.zeros(n + m)
+    for r, var in enumerate(basis):
+        x[var] = tableau[r, -1]
+    return x[:n]
+
+
+def weight_invariant(problem) -> Optional[Dict[str, int]]:
+    """
+    Searches for integer symbol weights w such that no transition lowers the
+    weighted symbol count w . count(s) while the initial string scores above zero.
+    Since the null string scores zero, such weights prove the puzzle unsolvable.
+
+    Solved as the linear program max w . count(initial) subject to
+    w . (count(tgt) - count(src)) >= 0 for every transition and -1 <= w <= 1, with
+    w split into non-negative parts. The optimum is rounded to integers and checked
+    exactly, so floating point error can only lose a certificate, never fake one.
+    """
+    problem = compile_problem(problem)
+    symbols = sorted(set(problem.initial_string).union(*(src + tgt for src, tgt in problem.rules())))
+    k = len(symbols)
+    initial = np.array(symbol_counts(problem.initial_string, symbols), dtype=float)
+    deltas = np.array([
+        [a - b for a, b in zip(symbol_counts(tgt, symbols), symbol_counts(src, symbols))]
+        for src, tgt in problem.rules()
+    ], dtype=float)
+
+    # w = p - q with 0 <= p, q <= 1
+    A = np.vstack([
+        np.hstack([-deltas, deltas]),
+        np.eye(2 * k),
+    ])
+    b = np.concatenate([np.zeros(len(deltas)), np.ones(2 * k)])
+    c = np.concatenate([initial, -initial])
+    x = _simplex_max(c, A, b)
+    if x is None or c @ x <= EPS:
+        return None
+
+    # Rescale the rational optimum to integers and verify exactly
+    fractions = [Fraction(float(v)).limit_denominator(1000) for v in x[:k] - x[k:]]
+    scale = math.lcm(*(f.denominator for f in fractions))
+    weights = [int(f * scale) for f in fractions]
+
+    def score(string):
+        return sum(w * n for w, n in zip(weights, symbol_counts(string, symbols)))
+
+    if score(problem.initial_string) <= 0:
+        return None
+    if any(score(tgt) < score(src) for src, tgt in problem.rules()):
+        return None
+    return {ch: w for ch, w in zip(symbols, weights) if w}
+
+
+def find_certificate(problem) -> Optional[Certificate]:
+    """Looks for a cheap proof that the puzzle cannot be solved, before any search runs"""
+    problem = compile_problem(problem)
+    initial = problem.initial_string
+    if initial == "":
+        return None
+
+    if not any(src == "" or src in initial for src in problem.srcs):
+        return Certificate("no transition applies to the initial string", {})
+
+    # A symbol no transition can ever remove
+    for ch in sorted(set(initial)):
+        if all(tgt.count(ch) >= src.count(ch) for src, tgt in problem.rules()):
+            return Certificate(f"no transition removes '{ch}'", {ch: 1})
+
+    weights = weight_invariant(problem)
+    if weights is not None:
+        terms = " + ".join(f"{w}*#{ch}" for ch, w in weights.items())
+        return Certificate(f"weighted count {terms} never decreases and starts positive", weights)
+
+    return None
@@ -1,8 +1,18 @@
-import os, json
+import os, re, sys, json, random, asyncio, argparse, logging, tempfile
 from pathlib import Path
-from typing import Dict, List
+from contextlib import nullcontext
+from typing import Dict, List, NamedTuple, Optional
 from tqdm import tqdm
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+import httpx
+
+from corpus import open_corpus
+from prompting import PromptTemplate, PrefillStats, SlotPool, cached_tokens
+from response_cache import ResponseCache, DEFAULT_RESPONSE_CACHE_PATH, request_key
+from stream_check import SolutionStream
+from grammar import solution_grammar
+from batch_response_parser import parse_batch_response_text
+from verifier import Verifier
 
 BASE_DIR = Path(__file__).parent.parent
 PROMPTS_DIR = BASE_DIR / "prompts" / "base_prompts"
@@ -12,6 +22,15 @@ OUTPUT_DIR = BASE_DIR / "data" / "SmolLM3"
 LOCAL_ENDPOINT = "http://localhost:8080/v1"
 LOCAL_MODEL = "local-model"
 
+# Requests in flight and server slots; match the server's slot count (llama-server --parallel)
+CONCURRENCY = 8
+REQUEST_TIMEOUT = 300  # seconds per attempt
+MAX_RETRIES = 3
+BACKOFF_BASE = 1.0  # seconds before the first retry, doubled on every further one
+
+SAMPLING = {"temperature": 0.0, "max_tokens": 2048}
+SAMPLE_TEMPERATURE = 0.7  # for --samples above 1
+
 PROMPT_TYPES = {
     "zero_shot": "zero_shot_prompt.md",
     "cot": "CoT_prompt.md",
@@ -19,56 +38,459 @@ PROMPT_TYPES = {
     "few_shot_cot": "Fewshot_CoT.md",
 }
 
+# Prompt types answered with a single final ```json block. CoT answers may draft a
+# block and correct it in a later one, so cutting them at a bad draft changes results
+SINGLE_BLOCK_TYPES = ("zero_shot", "few_shot")
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
 
 def load_prompt(name: str) -> str:
     return (PROMPTS_DIR / name).read_text()
 
 
-def load_problem(path: Path) -> Dict:
-    return json.loads(path.read_text())
+def format_prompt(template: str, problem: Dict) -> str:
+    return PromptTemplate(template).render(problem)
 
 
-def get_problems() -> List[Path]:
-    return sorted(PROBLEMS_DIR.glob("*.json"))
+class Answer(NamedTuple):
+    """A completion; invalid_at is the step at which a streamed solution stopped applying and generation was cut"""
+    text: str
+    invalid_at: Optional[int] = None
 
 
-def format_prompt(template: str, problem: Dict) -> str:
-    return template.replace("{{PROBLEM_JSON}}", json.dumps(problem, indent=2))
+def make_client(endpoint=LOCAL_ENDPOINT, concurrency=CONCURRENCY, transport=None) -> AsyncOpenAI:
+    """One pooled client for the whole run; retries are handled by query_llm. transport replaces the network (StubServer)"""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    return AsyncOpenAI(base_url=endpoint, api_key="not-needed", max_retries=0,
+                       http_client=DefaultAsyncHttpxClient(limits=limits, transport=transport))
 
 
-def query_llm(client: OpenAI, prompt: str) -> str:
+async def server_model(client: AsyncOpenAI) -> str:
+    """Name of the model the server has loaded (llama.cpp reports the model file), for cache keys"""
     try:
-        res = client.chat.completions.create(
-            model=LOCAL_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.0,
-            max_tokens=2048,
-        )
-        return res.choices[0].message.content
-    except Exception as e:
-        return json.dumps({"error": str(e)})
-
-
-def run():
-    client = OpenAI(base_url=LOCAL_ENDPOINT, api_key="not-needed")
-    problems = get_problems()
-    prompts = {k: load_prompt(v) for k, v in PROMPT_TYPES.items()}
-
-    for ptype, template in prompts.items():
-        out_dir = OUTPUT_DIR / ptype
-        out_dir.mkdir(parents=True, exist_ok=True)
-
-        for prob_file in tqdm(problems, desc=ptype):
-            pid = prob_file.stem
-            out_file = out_dir / f"{pid}_response.txt"
-            if out_file.exists():
+        models = await client.models.list()
+        return models.data[0].id
+    except Exception:
+        return LOCAL_MODEL
+
+
+async def stream_answer(client: AsyncOpenAI, messages, timeout, extra_body, stats, checker: SolutionStream,
+                        sampling=SAMPLING) -> Answer:
+    """Streams one completion through checker, closing the stream (which stops generation) once the solution is inapplicable"""
+    stream = await client.chat.completions.create(
+        model=LOCAL_MODEL,
+        messages=messages,
+        timeout=timeout,
+        extra_body=extra_body,
+        stream=True,
+        stream_options={"include_usage": True},
+        **sampling,
+    )
+    invalid_at = None
+    try:
+        async for chunk in stream:
+            usage = getattr(chunk, "usage", None)
+            if stats is not None and usage is not None:
+                stats.record(usage.prompt_tokens, cached_tokens(chunk))
+            if chunk.choices and chunk.choices[0].delta.content:
+                invalid_at = checker.feed(chunk.choices[0].delta.content)
+                if invalid_at is not None:
+                    break
+    finally:
+        await stream.close()
+    return Answer(checker.text, invalid_at)
+
+
+async def query_llm(client: AsyncOpenAI, prompt: str, timeout=REQUEST_TIMEOUT, retries=MAX_RETRIES,
+                    slot=None, stats: PrefillStats = None, cache: ResponseCache = None, model=LOCAL_MODEL,
+                    verifier: Verifier = None, grammar: str = None, sampling=SAMPLING) -> Answer:
+    """
+    Returns the completion, retrying failures with exponential backoff; raises after the last attempt.
+    Asks llama.cpp to reuse its cached prompt prefix, on the given slot if one is pinned.
+    With a cache, a request already answered for the same model, prompt and sampling params is not sent again.
+    With a verifier, the answer is streamed and cut off as soon as its solution stops applying.
+    A GBNF grammar, if given, constrains what the server may generate.
+    """
+    messages = [{"role": "user", "content": prompt}]
+    params = dict(sampling)
+    if verifier is not None:
+        params["abort_invalid"] = True
+    if grammar is not None:
+        params["grammar"] = grammar
+    key = request_key(model, messages, params)
+    if cache is not None:
+        hit, response = cache.lookup(key)
+        if hit:
+            return Answer(*response) if isinstance(response, list) else Answer(response)
+
+    extra_body = {"cache_prompt": True}
+    if slot is not None:
+        extra_body["id_slot"] = slot
+    if grammar is not None:
+        extra_body["grammar"] = grammar
+    for attempt in range(retries + 1):
+        try:
+            if verifier is not None:
+                answer = await stream_answer(client, messages, timeout, extra_body, stats, SolutionStream(verifier), sampling)
+            else:
+                res = await client.chat.completions.create(
+                    model=LOCAL_MODEL,
+                    messages=messages,
+                    timeout=timeout,
+                    extra_body=extra_body,
+                    **sampling,
+                )
+                usage = getattr(res, "usage", None)
+                if stats is not None and usage is not None:
+                    stats.record(usage.prompt_tokens, cached_tokens(res))
+                answer = Answer(res.choices[0].message.content)
+            if cache is not None:
+                cache.store(key, model, answer.text if verifier is None else list(answer))
+            return answer
+        except Exception:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(BACKOFF_BASE * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def is_valid_answer(text, verifier: Verifier) -> bool:
+    """True if some ```json block of the answer holds a solution the verifier accepts"""
+    for block in parse_batch_response_text(text):
+        try:
+            if verifier.check([int(i) for i in block["solution"]]).valid:
+                return True
+        except (TypeError, ValueError):
+            continue
+    return False
+
+
+async def sample_until_valid(request, n, verifier: Verifier):
+    """
+    Runs n copies of request() at once and checks each answer as it finishes.
+    Once one is valid the others are cancelled, which closes their connections
+    and stops their generation. Returns the first valid answer (else the last
+    one to finish, or None if every sample failed) and a record of the run.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    tasks = [asyncio.ensure_future(request()) for _ in range(n)]
+    answer, finished, failed, first_valid = None, 0, 0, None
+    try:
+        for task in asyncio.as_completed(tasks):
+            try:
+                result = await task
+            except Exception:
+                failed += 1
                 continue
+            finished += 1
+            answer = result
+            if is_valid_answer(result.text, verifier):
+                first_valid = loop.time() - start
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return answer, {
+        "valid": first_valid is not None,
+        "samples_finished": finished,
+        "samples_failed": failed,
+        "samples_cancelled": sum(task.cancelled() for task in tasks),
+        "latency_to_first_valid": first_valid,
+        "elapsed": loop.time() - start,
+    }
+
+
+def write_response(out_file: Path, response: str):
+    # Write then rename, so an interrupted run never leaves a partial file that resume would skip
+    tmp = out_file.with_suffix(".tmp")
+    tmp.write_text(response)
+    os.replace(tmp, out_file)
+
+
+def pending_jobs(prompt_types, problems_path=PROBLEMS_DIR, output_dir=OUTPUT_DIR, skip_saved=True) -> List:
+    """
+    (prompt, prompt type, output file, problem) for every prompt type and problem,
+    skipping saved responses if skip_saved. Jobs are grouped by prompt type, so
+    the requests in flight share one template prefix whichever slots serve them.
+    """
+    prompts = {k: PromptTemplate(load_prompt(PROMPT_TYPES[k])) for k in prompt_types}
+    for ptype in prompts:
+        (output_dir / ptype).mkdir(parents=True, exist_ok=True)
+    jobs = []
+    with open_corpus(problems_path) as problems:
+        for ptype, template in prompts.items():
+            for pid, problem in problems.items():
+                out_file = output_dir / ptype / f"{pid}_response.txt"
+                if skip_saved and out_file.exists():
+                    continue
+                jobs.append((template.render(problem), ptype, out_file, problem))
+    return jobs
+
+
+async def run_async(prompt_types=tuple(PROMPT_TYPES), concurrency=CONCURRENCY, timeout=REQUEST_TIMEOUT,
+                    retries=MAX_RETRIES, endpoint=LOCAL_ENDPOINT, client=None,
+                    problems_path=PROBLEMS_DIR, output_dir=OUTPUT_DIR, slots=0, cache=None,
+                    stream_check=False, abort_drafts=False, constrained=False, samples=1,
+                    temperature=SAMPLE_TEMPERATURE, requery=False):
+    """
+    Queries every pending (prompt type, problem) pair with at most concurrency
+    requests in flight. Each response is saved as soon as it arrives; failures
+    are logged and left unsaved, so running again retries exactly those.
+    By default the server places every request. With slots, a request also
+    asks for a free slot of its prompt type's share of them when there is one
+    and is placed by the server otherwise, so it is never held back.
+
+    A pair counts as done once its response file exists. With requery, saved
+    pairs are queried again and their files overwritten; with a ResponseCache
+    as well, only an edited prompt or a different model then reaches the
+    server, and an unchanged one is answered from the cache.
+
+    With stream_check, answers of SINGLE_BLOCK_TYPES are streamed and cut off
+    at the first solution step that does not apply; the cut answer is saved as
+    it stood and the step is logged to invalid_answers.jsonl. Other prompt
+    types are left whole unless abort_drafts is set, since a later block may
+    correct a bad draft.
+
+    With constrained, the server decodes under a per-problem grammar that
+    only admits the answer block with in-range transition indices.
+
+    With samples above 1, every pair gets that many concurrent samples at
+    temperature. The first sample whose
+    solution verifies is saved and the rest are cancelled; samples used and
+    latency to the first valid one are logged to samples.jsonl. Samples are
+    never served from the cache, so a rerun only samples the pairs whose
+    samples all failed.
+    """
+    if samples < 1:
+        raise ValueError(f"samples must be at least 1, got {samples}")
+    if samples > 1 and temperature <= 0:
+        raise ValueError("Several samples need a temperature above 0, or they would all be the same answer")
+    jobs = pending_jobs(prompt_types, problems_path, output_dir, skip_saved=not requery)
+    pool = SlotPool(prompt_types, slots) if slots else None
+    stats = PrefillStats()
+    own_client = client is None
+    client = client or make_client(endpoint, concurrency)
+    model = await server_model(client) if cache is not None else LOCAL_MODEL
+    semaphore = asyncio.Semaphore(concurrency)
+
+    sampling = SAMPLING if samples == 1 else dict(SAMPLING, temperature=temperature)
+    invalid, sampled = [], []
+
+    async def solve(prompt, ptype, out_file, problem):
+        checked = stream_check and (abort_drafts or ptype in SINGLE_BLOCK_TYPES)
+        verifier = Verifier.from_dict(problem) if checked else None
+        grammar = solution_grammar(problem) if constrained else None
+
+        async def request():
+            async with semaphore:
+                slot = pool.acquire(ptype) if pool is not None else None
+                try:
+                    return await query_llm(client, prompt, timeout, retries, slot,
+                                           stats, cache, model, verifier, grammar, sampling)
+                finally:
+                    if slot is not None:
+                        pool.release(slot)
+
+        if samples == 1:
+            try:
+                answer = await request()
+            except Exception as e:
+                logging.warning(f"{ptype}/{out_file.name} failed after {retries + 1} attempts: {e}")
+                return False
+        else:
+            answer, record = await sample_until_valid(request, samples, Verifier.from_dict(problem))
+            sampled.append(record)
+            with open(output_dir / "samples.jsonl", "a") as f:
+                f.write(json.dumps({"prompt_type": ptype, "problem_id": problem["problem_id"], **record}) + "\n")
+            if answer is None:
+                logging.warning(f"{ptype}/{out_file.name}: all {samples} samples failed")
+                return False
+        write_response(out_file, answer.text)
+        if answer.invalid_at is not None:
+            invalid.append(problem["problem_id"])
+            with open(output_dir / "invalid_answers.jsonl", "a") as f:
+                f.write(json.dumps({"prompt_type": ptype, "problem_id": problem["problem_id"],
+                                    "invalid_at": answer.invalid_at, "chars": len(answer.text)}) + "\n")
+        return True
+
+    try:
+        tasks = [asyncio.ensure_future(solve(*job)) for job in jobs]
+        done = 0
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="responses"):
+            done += await task
+    finally:
+        if own_client:
+            await client.close()
+
+    logging.info(f"Saved {done}/{len(jobs)} responses to {output_dir}")
+    if invalid:
+        logging.info(f"Cut {len(invalid)} answers short at their first inapplicable step")
+    if sampled:
+        valid = [r for r in sampled if r["valid"]]
+        logging.info(f"Valid within {samples} samples: {len(valid)}/{len(sampled)}, "
+                     f"{sum(r['samples_finished'] for r in sampled) / len(sampled):.2f} samples finished per problem")
+        if valid:
+            logging.info(f"Mean latency to first valid sample: {sum(r['latency_to_first_valid'] for r in valid) / len(valid):.2f}s")
+    logging.info(f"Prefill: {stats}")
+    if cache is not None:
+        logging.info(f"Response cache: {cache}")
+    return done
+
+
+def run(**kwargs):
+    return asyncio.run(run_async(**kwargs))
+
+
+class StubServer:
+    """
+    Stand-in for an OpenAI-compatible server, so run_async can be checked offline.
+
+    Serves the HTTP requests of a real client through httpx.MockTransport.
+    Every answer is a solution block for the problem id in the prompt. script
+    maps a problem id to how many of its requests fail with a 503 first. The
+    JSON body of every chat request and the most requests ever in flight at
+    once are kept.
+    """
+
+    @staticmethod
+    def problem_id(body):
+        return re.findall(r'"problem_id": "([^"<]+)"', body["messages"][-1]["content"])[-1]
+
+    def __init__(self, script=None, delay=0.01):
+        self.script = dict(script or {})
+        self.delay = delay
+        self.bodies = []
+        self.in_flight = self.peak = 0
+
+    def transport(self):
+        return httpx.MockTransport(self.handle)
+
+    def sent(self):
+        """Problem ids of the chat requests received, in order"""
+        return [self.problem_id(body) for body in self.bodies]
+
+    async def handle(self, request):
+        if request.url.path.endswith("/models"):
+            return httpx.Response(200, json={"object": "list", "data": [
+                {"id": "stub-model", "object": "model", "created": 0, "owned_by": "stub"}]})
+        body = json.loads(request.content)
+        self.bodies.append(body)
+        pid = self.problem_id(body)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        if self.script.get(pid, 0) > 0:
+            self.script[pid] -= 1
+            return httpx.Response(503, json={"error": {"message": "Service Unavailable"}})
+        text = f"```json\n{json.dumps({'problem_id': pid, 'solution': [0]})}\n```"
+        return httpx.Response(200, json={
+            "id": "stub", "object": "chat.completion", "created": 0, "model": "stub-model",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}})
+
+
+def selftest(prompt_type="zero_shot", concurrency=4, problems_path=PROBLEMS_DIR):
+    """
+    Runs run_async for one prompt type against StubServer in a temporary output
+    folder, without the response cache, and checks that no more than
+    concurrency requests are in flight, that a failed request is retried, that
+    a problem failing on every attempt is left unsaved, and that a rerun only
+    queries that problem. With a ResponseCache, saved responses must still be
+    skipped unless requery is set. A constrained run into another folder must
+    send each problem's solution_grammar in the request body. Returns the
+    number of failed checks.
+    """
+    with open_corpus(problems_path) as corpus:
+        ids = list(corpus.ids())
+        grammars = {pid: solution_grammar(problem) for pid, problem in corpus.items()}
+    retries = 1
+    script = {ids[0]: 1, ids[1]: retries + 1}
+    failures = 0
+
+    def check(ok, what):
+        nonlocal failures
+        failures += not ok
+        print(f"  {'ok  ' if ok else 'FAIL'} {what}")
+
+    with tempfile.TemporaryDirectory() as out:
+        out = Path(out)
+
+        def run_stub(server, output_dir=out, **kwargs):
+            async def go():
+                async with make_client(concurrency=concurrency, transport=server.transport()) as client:
+                    return await run_async(prompt_types=(prompt_type,), concurrency=concurrency, retries=retries,
+                                           client=client, problems_path=problems_path, output_dir=output_dir, **kwargs)
+            return asyncio.run(go())
+
+        server = StubServer(script)
+        done = run_stub(server)
+        saved = sorted(path.name for path in (out / prompt_type).glob("*_response.txt"))
+        sent = server.sent()
+        check(server.peak == concurrency, f"{server.peak} requests in flight at most, for a concurrency of {concurrency}")
+        check(sent.count(ids[0]) == 2, "failed request retried once")
+        check(sent.count(ids[1]) == retries + 1, f"always failing request tried {retries + 1} times")
+        check(done == len(ids) - 1 and f"{ids[1]}_response.txt" not in saved, f"{done}/{len(ids)} responses saved, all but the failing one")
+        check(all(parse_batch_response_text((out / prompt_type / name).read_text())[0]["problem_id"] == name[:-len("_response.txt")]
+                  for name in saved), "every saved response answers its own problem")
+
+        rerun = StubServer()
+        done = run_stub(rerun)
+        check(rerun.sent() == [ids[1]] and done == 1, "rerun queries only the unsaved problem")
+        check(all("grammar" not in body for body in server.bodies + rerun.bodies), "no grammar sent unless constrained")
+
+        kept = out / prompt_type / f"{ids[0]}_response.txt"
+        kept.write_text("saved earlier")
+        with ResponseCache(out / "cache.sqlite") as cache:
+            cached = StubServer()
+            run_stub(cached, cache=cache)
+            check(not cached.sent() and kept.read_text() == "saved earlier", "cached run leaves saved responses alone")
+            requeried = StubServer()
+            run_stub(requeried, cache=cache, requery=True)
+            check(len(requeried.sent()) == len(ids) and kept.read_text() != "saved earlier", "requery overwrites saved responses")
+            answered = StubServer()
+            done = run_stub(answered, cache=cache, requery=True)
+            check(not answered.sent() and done == len(ids), "second requery answered from the response cache")
 
-            problem = load_problem(prob_file)
-            prompt = format_prompt(template, problem)
-            response = query_llm(client, prompt)
-            out_file.write_text(response)
+        constrained = StubServer()
+        run_stub(constrained, output_dir=out / "constrained", constrained=True)
+        sent = {constrained.problem_id(body): body.get("grammar") for body in constrained.bodies}
+        check(len(constrained.bodies) == len(ids) and sent == grammars,
+              "constrained run sends each problem's GBNF grammar in its request body")
+    print(f"Selftest: {'passed' if not failures else f'{failures} checks failed'}")
+    return failures
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="Query a local OpenAI-compatible server for every problem")
+    parser.add_argument("--endpoint", default=LOCAL_ENDPOINT)
+    parser.add_argument("--prompt_type", action="append", choices=sorted(PROMPT_TYPES), help="Prompt type (repeatable, defaults to all)")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Requests in flight; match the server's slot count")
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT, help="Timeout per attempt in seconds")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES)
+    parser.add_argument("--slots", type=int, default=0, help="Server slots to share out between prompt types as a placement preference (0 leaves placement to the server)")
+    parser.add_argument("--cache", type=Path, default=DEFAULT_RESPONSE_CACHE_PATH, help="Response cache file")
+    parser.add_argument("--no_cache", action="store_true", help="Neither read nor write the response cache")
+    parser.add_argument("--requery", action="store_true", help="Query problems with a saved response file again and overwrite it")
+    parser.add_argument("--stream_check", action="store_true", help="Stream single-block answers and stop each one at its first inapplicable step")
+    parser.add_argument("--abort_drafts", action="store_true", help="With --stream_check, also cut CoT answers at their first bad block")
+    parser.add_argument("--constrained", action="store_true", help="Restrict decoding to the answer block with valid transition indices")
+    parser.add_argument("--samples", type=int, default=1, help="Concurrent samples per problem; stops at the first verified one")
+    parser.add_argument("--temperature", type=float, default=SAMPLE_TEMPERATURE, help="Sampling temperature when --samples is above 1")
+    parser.add_argument("--selftest", action="store_true", help="Check concurrency, retries and resuming against a stub server")
+    args = parser.parse_args()
+    if args.selftest:
+        sys.exit(selftest(prompt_type=(args.prompt_type or ["zero_shot"])[0], concurrency=args.concurrency) > 0)
+    if args.samples < 1:
+        parser.error("--samples must be at least 1")
+    if args.samples > 1 and args.temperature <= 0:
+        parser.error("--samples above 1 needs a --temperature above 0")
+    with (nullcontext() if args.no_cache else ResponseCache(args.cache)) as cache:
+        run(prompt_types=args.prompt_type or tuple(PROMPT_TYPES), concurrency=args.concurrency, timeout=args.timeout,
+            retries=args.retries, endpoint=args.endpoint, slots=args.slots,
+            cache=cache, stream_check=args.stream_check, abort_drafts=args.abort_drafts, constrained=args.constrained,
+            samples=args.samples, temperature=args.temperature, requery=args.requery)
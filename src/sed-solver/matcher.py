@@ -0,0 +1,167 @@
+from collections import deque
+
+from compiled import compile_problem
+
+# Below this many distinct patterns a handful of C-level str.find calls beats a
+# Python-level automaton scan, so the automaton is only used for large rule sets.
+AUTOMATON_MIN_PATTERNS = 16
+
+
+class RuleMatcher:
+    """
+    Compiled rule set that finds the leftmost occurrence of every transition src.
+
+    Rules sharing a src are matched once. Large rule sets are compiled into an
+    Aho-Corasick automaton, so a single left-to-right scan reports all leftmost
+    matches and stops as soon as every pattern has been seen. Empty srcs always
+    match at position 0.
+    """
+
+    goal = ""
+
+    def __init__(self, srcs, tgts):
+        self.srcs = list(srcs)
+        self.tgts = list(tgts)
+
+        # Rules sharing a src share one pattern
+        self.patterns = []
+        self.pattern_rules = []
+        pattern_ids = {}
+        for i, src in enumerate(self.srcs):
+            if not src:
+                continue
+            if src not in pattern_ids:
+                pattern_ids[src] = len(self.patterns)
+                self.patterns.append(src)
+                self.pattern_rules.append([])
+            self.pattern_rules[pattern_ids[src]].append(i)
+        self.empty_rules = [i for i, src in enumerate(self.srcs) if not src]
+
+        self.use_automaton = len(self.patterns) >= AUTOMATON_MIN_PATTERNS
+        if self.use_automaton:
+            self._build_automaton()
+
+    @classmethod
+    def from_problem(cls, problem):
+        problem = compile_problem(problem)
+        return cls(problem.srcs, problem.tgts)
+
+    def __len__(self):
+        return len(self.srcs)
+
+    # States are plain strings; these mirror the PackedRules interface
+    def encode(self, string):
+        return string
+
+    def decode(self, state):
+        return state
+
+    def _build_automaton(self):
+        goto = [{}]
+        output = [[]]
+        for pid, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern:
+                if ch not in goto[state]:
+                    goto.append({})
+                    output.append([])
+                    goto[state][ch] = len(goto) - 1
+                state = goto[state][ch]
+            output[state].append(pid)
+
+        # Resolve failure links breadth-first into a full transition table so the
+        # scan does a single dict lookup per character
+        alphabet = {ch for pattern in self.patterns for ch in pattern}
+        fail = [0] * len(goto)
+        delta = [dict() for _ in goto]
+        queue = deque()
+        for ch in alphabet:
+            nxt = goto[0].get(ch, 0)
+            delta[0][ch] = nxt
+            if nxt:
+                queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            output[state] = output[state] + output[fail[state]]
+            for ch in alphabet:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    delta[state][ch] = delta[fail[state]][ch]
+                else:
+                    fail[nxt] = delta[fail[state]][ch]
+                    delta[state][ch] = nxt
+                    queue.append(nxt)
+
+        self.delta = delta
+        self.output = [tuple((pid, len(self.patterns[pid]) - 1) for pid in out) for out in output]
+
+    def leftmost(self, string):
+        """Returns the leftmost match position of every rule's src in string (-1 if absent)"""
+        positions = [-1] * len(self.srcs)
+        for i in self.empty_rules:
+            positions[i] = 0
+
+        if not self.use_automaton:
+            for pattern, rules in zip(self.patterns, self.pattern_rules):
+                pos = string.find(pattern)
+                if pos != -1:
+                    for i in rules:
+                        positions[i] = pos
+            return positions
+
+        delta = self.delta
+        output = self.output
+        pattern_rules = self.pattern_rules
+        remaining = len(self.patterns)
+        found = [False] * remaining
+        state = 0
+        for end, ch in enumerate(string):
+            state = delta[state].get(ch, 0)
+            for pid, offset in output[state]:
+                if not found[pid]:
+                    found[pid] = True
+                    for i in pattern_rules[pid]:
+                        positions[i] = end - offset
+                    remaining -= 1
+            if not remaining:
+                break
+        return positions
+
+    def successors(self, string):
+        """Yields (rule index, resulting string) for every rule applicable to string"""
+        srcs, tgts = self.srcs, self.tgts
+        for i, pos in enumerate(self.leftmost(string)):
+            if pos != -1:
+                yield i, string[:pos] + tgts[i] + string[pos + len(srcs[i]):]
+
+    def predecessors(self, string):
+        """Yields (rule index, previous string) for every string that rewrites to string in one step"""
+        for i, (src, tgt) in enumerate(zip(self.srcs, self.tgts)):
+            # Undo the rule at every occurrence of tgt, keeping only the edges
+            # where src is really the leftmost match in the previous string
+            pos = string.find(tgt)
+            while pos != -1:
+                prev = string[:pos] + src + string[pos + len(tgt):]
+                if (prev.find(src) if src else 0) == pos:
+                    yield i, prev
+                pos = string.find(tgt, pos + 1)
+
+    def apply(self, string, rule):
+        """Applies a single rule at its leftmost match, returning None if it does not match"""
+        src = self.srcs[rule]
+        pos = string.find(src) if src else 0
+        if pos == -1:
+            return None
+        return string[:pos] + self.tgts[rule] + string[pos + len(src):]
+
+
+def reaches_goal(matcher, initial, solution):
+    """Replays a solution with leftmost-match semantics and checks that it ends at the null string"""
+    current = initial
+    for i in solution:
+        if not 0 <= i < len(matcher):
+            return False
+        current = matcher.apply(current, i)
+        if current is None:
+            return False
+    return current == ""
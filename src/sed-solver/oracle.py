@@ -0,0 +1,117 @@
+import time
+from array import array
+
+from matcher import RuleMatcher
+from search import StateStore
+from compiled import compile_problem
+
+
+class DistanceOracle:
+    """
+    Distance-to-goal table for one puzzle, built once and then queried by lookup.
+
+    Every string an answer can leave behind is reachable from the initial string,
+    so the oracle first interns the states reachable from it (up to max_states or
+    time_limit), then runs a backward breadth-first closure from the null string
+    over the reversed edges of that graph. When the forward closure finishes, the
+    table is exhaustive: distances are exact, and a reachable string with no
+    distance is a dead end.
+    """
+
+    def __init__(self, problem, max_states=1_000_000, time_limit=5):
+        problem = compile_problem(problem)
+        matcher = RuleMatcher.from_problem(problem)
+        self.store = StateStore()
+        self.store.add(problem.initial_string)
+        reverse = [[]]  # id -> ids of the states that rewrite to it
+
+        head = 0
+        self.exhaustive = True
+        start_time = time.time()  # Record the start time
+        while head < len(self.store) and self.exhaustive:
+            if time.time() - start_time > time_limit:
+                self.exhaustive = False
+                break
+            for _, new_string in matcher.successors(self.store.states[head]):
+                nid = self.store.ids.get(new_string)
+                if nid is None:
+                    if len(self.store) >= max_states:
+                        self.exhaustive = False
+                        break
+                    nid = self.store.add(new_string)
+                    reverse.append([])
+                reverse[nid].append(head)
+            head += 1
+
+        # Backward closure from the null string over the reversed edges
+        self.distance = array("i", [-1]) * len(self.store)
+        goal = self.store.ids.get("")
+        if goal is not None:
+            self.distance[goal] = 0
+            layer = [goal]
+            while layer:
+                next_layer = []
+                for sid in layer:
+                    for pid in reverse[sid]:
+                        if self.distance[pid] == -1:
+                            self.distance[pid] = self.distance[sid] + 1
+                            next_layer.append(pid)
+                layer = next_layer
+
+    def __len__(self):
+        return len(self.store)
+
+    def steps_remaining(self, string):
+        """Shortest number of steps from string to the null string, or None if not known exactly"""
+        sid = self.store.ids.get(string)
+        if sid is None or self.distance[sid] == -1 or not self.exhaustive:
+            return None
+        return self.distance[sid]
+
+    def is_deadend(self, string):
+        """True/False when the table decides it, None when a search is still needed"""
+        sid = self.store.ids.get(string)
+        if sid is None:
+            return None
+        if self.distance[sid] != -1:
+            return False
+        return True if self.exhaustive else None
+
+
+class OracleCache:
+    """
+    Shares one DistanceOracle per problem_id across batch files.
+
+    Building an oracle costs about as much as one exhaustive search, so it has to
+    pay for itself. A problem is only considered once it has been queried
+    min_queries times, and its closure is only attempted with as many states as
+    its fallback searches have expanded so far (reported with record_search), up
+    to max_states. A closure that does not fit is dropped for good. get returns
+    None unless a problem has an exhaustive oracle, and callers keep searching
+    each leftover directly.
+    """
+
+    def __init__(self, min_queries=3, max_states=10_000, **oracle_kwargs):
+        self.min_queries = min_queries
+        self.max_states = max_states
+        self.oracle_kwargs = oracle_kwargs
+        self.queries = {}
+        self.spent = {}  # problem_id -> nodes expanded by its fallback searches
+        self.oracles = {}  # problem_id -> exhaustive oracle, or None once its closure did not fit
+
+    def __len__(self):
+        return sum(oracle is not None for oracle in self.oracles.values())
+
+    def record_search(self, problem_id, nodes):
+        self.spent[problem_id] = self.spent.get(problem_id, 0) + nodes
+
+    def get(self, problem):
+        pid = problem.problem_id
+        if pid not in self.oracles:
+            self.queries[pid] = self.queries.get(pid, 0) + 1
+            budget = min(self.spent.get(pid, 0), self.max_states)
+            if self.queries[pid] < self.min_queries or budget == 0:
+                return None
+            oracle = DistanceOracle(problem, max_states=budget, **self.oracle_kwargs)
+            self.oracles[pid] = oracle if oracle.exhaustive else None
+        return self.oracles[pid]
@@ -0,0 +1,86 @@
+from compiled import compile_problem
+
+MAX_PACKED_SYMBOLS = 16
+
+
+class PackedRules:
+    """
+    Rule set over a small alphabet whose states are packed into Python ints.
+
+    Every symbol is a fixed-width code of 1, 2 or 4 bits, written most significant
+    first below a leading sentinel bit, so a single int carries both the length and
+    the contents of a string and the null string is 1. An int of this size costs a
+    fraction of the equivalent str object, so many more visited states fit in RAM.
+
+    Replacement is done with shifts and masks. Leftmost matches are located by
+    scanning the base-2 rendering of the state in C, keeping only hits that are
+    aligned to symbol boundaries.
+    """
+
+    goal = 1
+
+    def __init__(self, srcs, tgts, alphabet):
+        self.srcs = list(srcs)
+        self.tgts = list(tgts)
+        self.alphabet = sorted(alphabet)
+        if len(self.alphabet) > MAX_PACKED_SYMBOLS:
+            raise ValueError(f"Alphabet of {len(self.alphabet)} symbols is too large to pack")
+
+        size = max(len(self.alphabet), 2)
+        self.bits = 1 if size <= 2 else 2 if size <= 4 else 4
+        self.codes = {ch: code for code, ch in enumerate(self.alphabet)}
+        self.symbols = {format(code, f"0{self.bits}b"): ch for ch, code in self.codes.items()}
+
+        # Per rule: base-2 pattern of src, src length in bits, tgt code and tgt length in bits
+        self.src_patterns = [self._digits(src) for src in self.srcs]
+        self.src_bits = [len(src) * self.bits for src in self.srcs]
+        self.tgt_codes = [self._code(tgt) for tgt in self.tgts]
+        self.tgt_bits = [len(tgt) * self.bits for tgt in self.tgts]
+
+    @classmethod
+    def from_problem(cls, problem):
+        problem = compile_problem(problem)
+        return cls(problem.srcs, problem.tgts, problem_alphabet(problem))
+
+    def __len__(self):
+        return len(self.srcs)
+
+    def _digits(self, string):
+        return "".join(format(self.codes[ch], f"0{self.bits}b") for ch in string)
+
+    def _code(self, string):
+        return int(self._digits(string), 2) if string else 0
+
+    def encode(self, string):
+        return int("1" + self._digits(string), 2)
+
+    def decode(self, state):
+        digits = format(state, "b")
+        return "".join(self.symbols[digits[i:i + self.bits]] for i in range(1, len(digits), self.bits))
+
+    def successors(self, state):
+        """Yields (rule index, resulting state) for every rule applicable to state"""
+        bits = self.bits
+        digits = format(state, "b")
+        total_bits = len(digits) - 1
+        for i, pattern in enumerate(self.src_patterns):
+            # Leftmost hit whose offset after the sentinel is a whole number of symbols
+            pos = digits.find(pattern, 1)
+            while pos != -1 and (pos - 1) % bits:
+                pos = digits.find(pattern, pos + 1)
+            if pos == -1:
+                continue
+
+            suffix_bits = total_bits - (pos - 1) - self.src_bits[i]
+            prefix = state >> (suffix_bits + self.src_bits[i])
+            suffix = state & ((1 << suffix_bits) - 1)
+            yield i, (((prefix << self.tgt_bits[i]) | self.tgt_codes[i]) << suffix_bits) | suffix
+
+
+def problem_alphabet(problem):
+    problem = compile_problem(problem)
+    alphabet = set(problem.initial_string)
+    for src, tgt in problem.rules():
+        alphabet.update(src)
+        alphabet.update(tgt)
+    return alphabet
@@ -0,0 +1,90 @@
+import json
+from dataclasses import dataclass
+
+PLACEHOLDER = "{{PROBLEM_JSON}}"
+
+# Template text after the problem longer than this is moved in front of it, so the
+# prefix the server can cache covers it; shorter answer cues stay after the problem
+MAX_SUFFIX_CHARS = 64
+
+
+def split_label(head):
+    """Splits the line that introduces the problem (e.g. "**Input:**") off the end of head"""
+    cut = head.rstrip("\n").rfind("\n") + 1 if head.endswith("\n") else head.rfind("\n") + 1
+    return head[:cut], head[cut:]
+
+
+class PromptTemplate:
+    """
+    Prompt template laid out as a static prefix followed by the problem.
+
+    Every prompt rendered from one template starts with the same prefix, byte for
+    byte, so a server that caches prompt prefixes (llama.cpp cache_prompt, Gemini
+    implicit caching) only has to prefill the problem itself.
+    """
+
+    def __init__(self, text):
+        head, found, tail = text.partition(PLACEHOLDER)
+        if not found:
+            self.prefix, self.suffix = text.rstrip("\n") + "\n\n", ""
+        elif len(tail.strip()) <= MAX_SUFFIX_CHARS:
+            self.prefix, self.suffix = head, tail
+        else:
+            body, label = split_label(head)
+            self.prefix = body.rstrip("\n") + "\n\n" + tail.strip("\n") + "\n\n" + label
+            self.suffix = ""
+
+    def render(self, problem):
+        return self.prefix + json.dumps(problem, indent=2) + self.suffix
+
+
+@dataclass
+class PrefillStats:
+    """Prompt tokens sent and the share the server answered from its prompt cache"""
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+
+    def record(self, prompt_tokens, cached_tokens):
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens or 0
+        self.cached_tokens += cached_tokens or 0
+
+    def __str__(self):
+        share = self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+        return f"{self.cached_tokens}/{self.prompt_tokens} prompt tokens served from cache ({share:.0%}) over {self.requests} requests"
+
+
+def cached_tokens(res):
+    """Prompt tokens a chat completion reused from the server cache (OpenAI usage field or llama.cpp timings)"""
+    details = getattr(getattr(res, "usage", None), "prompt_tokens_details", None)
+    if details is not None and getattr(details, "cached_tokens", None) is not None:
+        return details.cached_tokens
+    timings = (getattr(res, "model_extra", None) or {}).get("timings") or {}
+    return timings.get("cache_n", 0)
+
+
+class SlotPool:
+    """
+    Server slots shared out between prompt types, so a slot keeps seeing one
+    template and its cached prefix stays valid. A request takes a free slot of
+    its type's share; when the whole share is busy it takes none and the server
+    places it, so a preference never holds a request back behind a busy slot.
+    """
+
+    def __init__(self, prompt_types, slots):
+        share = max(1, slots // len(prompt_types))
+        self.shares = {ptype: [(i * share + k) % slots for k in range(share)]
+                       for i, ptype in enumerate(prompt_types)}
+        self.busy = set()
+
+    def acquire(self, prompt_type):
+        """A free slot of prompt_type's share, marked busy, or None"""
+        for slot in self.shares[prompt_type]:
+            if slot not in self.busy:
+                self.busy.add(slot)
+                return slot
+        return None
+
+    def release(self, slot):
+        self.busy.discard(slot)
@@ -0,0 +1,122 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from functools import lru_cache
+
+DEFAULT_RESPONSE_CACHE_PATH = Path("./data/cache/llm_responses.sqlite")
+
+# Request options that change how a completion is fetched, not what it says
+TRANSPORT_PARAMS = {"api_key", "api_base", "base_url", "timeout", "num_retries", "cache", "cache_prompt", "id_slot"}
+
+
+def request_key(model, prompt, params):
+    """
+    Hash of everything that determines a deterministic completion: the model,
+    the full prompt (a string or a message list) and the sampling params.
+    Returns None for sampled requests (temperature unset or above 0), which
+    must not be served from the cache.
+    """
+    params = {k: v for k, v in params.items() if k not in TRANSPORT_PARAMS}
+    if params.get("temperature") != 0:
+        return None
+    canonical = json.dumps([model, prompt, params], sort_keys=True, separators=(",", ":"),
+                           ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk LLM response cache keyed by request_key.
+
+    Entries are evicted least-recently-used once the cache holds more than
+    max_entries or its responses exceed max_bytes. Backed by SQLite in WAL mode,
+    so several processes can share one cache file; one instance may be used from
+    several threads.
+    """
+
+    EVICT_EVERY = 64  # Check the size limits once per this many writes
+
+    def __init__(self, path=DEFAULT_RESPONSE_CACHE_PATH, max_entries=100_000, max_bytes=1 << 30):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.bypassed = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, last_used REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def lookup(self, key):
+        """Returns (hit, response); a None key (sampled request) is never a hit"""
+        with self.lock:
+            if key is None:
+                self.bypassed += 1
+                return False, None
+            row = self.db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            return True, json.loads(row[0])
+
+    def store(self, key, model, response):
+        """Stores a JSON-serializable response; a None key is ignored"""
+        if key is None:
+            return
+        encoded = json.dumps(response, ensure_ascii=False)
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, model, encoded, len(encoded.encode()), time.time()),
+            )
+            self.writes += 1
+            if self.writes % self.EVICT_EVERY == 0:
+                self._evict()
+
+    def evict(self):
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        """Drops the least recently used entries beyond max_entries or max_bytes"""
+        self.db.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        self.db.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM "
+            "(SELECT key, SUM(size) OVER (ORDER BY last_used DESC) AS total FROM responses) WHERE total > ?)",
+            (self.max_bytes,),
+        )
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        share = self.hits / lookups if lookups else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({share:.0%} hit rate), {self.bypassed} bypassed (temperature > 0)"
+
+
+@lru_cache(maxsize=None)
+def shared_cache(path=DEFAULT_RESPONSE_CACHE_PATH):
+    """One ResponseCache per file for the whole process"""
+    return ResponseCache(path)
@@ -0,0 +1,536 @@
+import zlib
+import time
+import heapq
+import math
+import threading
+import multiprocessing
+import multiprocessing.connection
+from array import array
+
+from matcher import RuleMatcher, reaches_goal
+from packed import PackedRules, problem_alphabet, MAX_PACKED_SYMBOLS
+from external import external_bfs
+from stats import Budget
+from compiled import compile_problem
+
+
+class StateStore:
+    """
+    Interns search states as integer ids.
+
+    Each state string is stored exactly once; parent pointers and the index of
+    the transition that produced a state live in flat integer arrays indexed by id.
+    Ids are handed out in discovery order, so for a breadth-first search the FIFO
+    frontier is simply the id range [head, len(store)).
+    """
+
+    def __init__(self):
+        self.ids = {}               # state -> id
+        self.states = []            # id -> state
+        self.parent = array("i")    # id -> parent id (-1 for the root)
+        self.rule = array("i")      # id -> transition index (-1 for the root)
+
+    def __len__(self):
+        return len(self.states)
+
+    def __contains__(self, state):
+        return state in self.ids
+
+    def add(self, state, parent=-1, rule=-1):
+        """Interns a new state and returns its id"""
+        sid = len(self.states)
+        self.ids[state] = sid
+        self.states.append(state)
+        self.parent.append(parent)
+        self.rule.append(rule)
+        return sid
+
+    def path(self, sid):
+        """Returns the transition indices leading from the root to the given state"""
+        solution = []
+        while self.parent[sid] != -1:
+            solution.append(self.rule[sid])
+            sid = self.parent[sid]
+        return solution[::-1]
+
+
+def compile_rules(problem, encoding="str"):
+    """
+    Compiles a problem's transitions for the search loop.
+
+    encoding is "str" for plain string states, "packed" for PackedRules, or "auto"
+    to pack whenever the problem's alphabet is small enough. Packed states use
+    somewhat less memory but are expanded more slowly, so they are opt-in.
+    """
+    if encoding == "auto":
+        encoding = "packed" if len(problem_alphabet(problem)) <= MAX_PACKED_SYMBOLS else "str"
+    if encoding == "packed":
+        return PackedRules.from_problem(problem)
+    return RuleMatcher.from_problem(problem)
+
+
+def bfs(problem, time_limit=5, encoding="str", stats=None, max_nodes=None):
+    problem = compile_problem(problem)
+    rules = compile_rules(problem, encoding)
+    budget = Budget(time_limit, max_nodes)
+
+    store = StateStore()
+    store.add(rules.encode(problem.initial_string))
+    head = 0  # Front of the FIFO queue of ids
+    generated = duplicates = peak_frontier = 0
+    solution, reason = None, "exhausted"
+
+    while head < len(store):
+        reason = budget.spent(head)
+        if reason:
+            break
+        sid = head
+        head += 1
+        current_string = store.states[sid]
+
+        # Check if the target string is empty
+        if current_string == rules.goal:
+            solution, reason = store.path(sid), "solved"
+            break
+
+        # Process all transitions
+        for i, new_string in rules.successors(current_string):
+            generated += 1
+            if new_string not in store:
+                store.add(new_string, sid, i)
+            else:
+                duplicates += 1
+        peak_frontier = max(peak_frontier, len(store) - head)
+    else:
+        reason = "exhausted"  # No solution found
+
+    if stats is not None:
+        stats.finish(reason, budget, head, generated, duplicates, peak_frontier)
+    return solution
+
+
+def bidirectional_bfs(problem, time_limit=5, stats=None, max_nodes=None):
+    """
+    Breadth-first search grown from both ends until the two frontiers meet.
+
+    The backward side starts at the null string and undoes transitions with
+    RuleMatcher.predecessors. Whole layers are expanded at a time, always on the
+    side with the smaller frontier, so the first meeting state lies on a shortest
+    solution.
+    """
+    problem = compile_problem(problem)
+    matcher = RuleMatcher.from_problem(problem)
+    budget = Budget(time_limit, max_nodes)
+    initial = problem.initial_string
+
+    forward = StateStore()
+    forward.add(initial)
+    backward = StateStore()  # parent points one step closer to the null string
+    backward.add("")
+    forward_layer = [0]
+    backward_layer = [0]
+    expanded = generated = duplicates = 0
+    peak_frontier = 2
+    solution, reason = None, "exhausted"
+
+    if initial == "":
+        solution, reason = [], "solved"
+
+    while reason == "exhausted" and forward_layer and backward_layer:
+        expand_forward = len(forward_layer) <= len(backward_layer)
+        if expand_forward:
+            store, other, layer, neighbours = forward, backward, forward_layer, matcher.successors
+        else:
+            store, other, layer, neighbours = backward, forward, backward_layer, matcher.predecessors
+
+        next_layer = []
+        for sid in layer:
+            reason = budget.spent(expanded) or "exhausted"
+            if reason != "exhausted":
+                break
+            expanded += 1
+
+            for i, new_string in neighbours(store.states[sid]):
+                generated += 1
+                if new_string in store:
+                    duplicates += 1
+                    continue
+                nid = store.add(new_string, sid, i)
+                next_layer.append(nid)
+
+                oid = other.ids.get(new_string)
+                if oid is not None:
+                    fid, bid = (nid, oid) if expand_forward else (oid, nid)
+                    solution, reason = forward.path(fid) + backward.path(bid)[::-1], "solved"
+                    if not reaches_goal(matcher, initial, solution):
+                        raise RuntimeError(f"Bidirectional search built an invalid solution for {problem.problem_id}")
+                    break
+            if reason == "solved":
+                break
+
+        if expand_forward:
+            forward_layer = next_layer
+        else:
+            backward_layer = next_layer
+        peak_frontier = max(peak_frontier, len(forward_layer) + len(backward_layer))
+
+    if stats is not None:
+        stats.finish(reason, budget, expanded, generated, duplicates, peak_frontier)
+    return solution
+
+
+def length_heuristic(matcher):
+    """
+    Builds an admissible estimate of the number of steps left to reach the null string.
+
+    One step can shorten the string by at most the largest len(src) - len(tgt), and
+    can remove at most a fixed number of copies of each symbol, so the string length
+    and every symbol count give a lower bound; the estimate is the largest of them.
+    Strings holding something no rule can remove get math.inf. Each bound drops by at
+    most one per step, so the heuristic is also consistent.
+    """
+    max_shrink = max(len(src) - len(tgt) for src, tgt in zip(matcher.srcs, matcher.tgts))
+    symbols = {ch for src in matcher.srcs for ch in src}
+    symbols.update(ch for tgt in matcher.tgts for ch in tgt)
+    symbol_shrink = {
+        ch: max(src.count(ch) - tgt.count(ch) for src, tgt in zip(matcher.srcs, matcher.tgts))
+        for ch in symbols
+    }
+
+    def heuristic(string):
+        if string == "":
+            return 0
+        if max_shrink <= 0:
+            return math.inf
+        estimate = -(-len(string) // max_shrink)
+        for ch in set(string):
+            shrink = symbol_shrink.get(ch, 0)
+            if shrink <= 0:
+                return math.inf
+            estimate = max(estimate, -(-string.count(ch) // shrink))
+        return estimate
+
+    return heuristic
+
+
+def astar(problem, time_limit=5, stats=None, max_nodes=None):
+    """A* search with length_heuristic; returns a shortest solution like bfs"""
+    problem = compile_problem(problem)
+    matcher = RuleMatcher.from_problem(problem)
+    heuristic = length_heuristic(matcher)
+    budget = Budget(time_limit, max_nodes)
+
+    store = StateStore()
+    root = store.add(problem.initial_string)
+    cost = array("i", [0])  # id -> best known number of steps from the root
+    h = heuristic(problem.initial_string)
+    # Ties on f are broken towards deeper states, then by discovery order
+    heap = [(h, 0, root)] if h != math.inf else []
+    expanded = generated = duplicates = 0
+    peak_frontier = len(heap)
+    solution, reason = None, "exhausted"
+
+    while heap:
+        _, neg_g, sid = heapq.heappop(heap)
+        if -neg_g != cost[sid]:
+            continue  # Stale entry superseded by a cheaper path
+
+        reason = budget.spent(expanded) or "exhausted"
+        if reason != "exhausted":
+            break
+        expanded += 1
+
+        current_string = store.states[sid]
+        if current_string == "":
+            solution, reason = store.path(sid), "solved"
+            break
+
+        g = cost[sid] + 1
+        for i, new_string in matcher.successors(current_string):
+            generated += 1
+            nid = store.ids.get(new_string)
+            if nid is None:
+                h = heuristic(new_string)
+                if h == math.inf:
+                    continue
+                nid = store.add(new_string, sid, i)
+                cost.append(g)
+            elif g < cost[nid]:
+                h = heuristic(new_string)
+                store.parent[nid] = sid
+                store.rule[nid] = i
+                cost[nid] = g
+            else:
+                duplicates += 1
+                continue
+            heapq.heappush(heap, (g + h, -g, nid))
+        peak_frontier = max(peak_frontier, len(heap))
+
+    if stats is not None:
+        stats.finish(reason, budget, expanded, generated, duplicates, peak_frontier)
+    return solution
+
+
+def idastar(problem, time_limit=5, table_size=1_000_000, stats=None, max_nodes=None):
+    """
+    Iterative-deepening A* with length_heuristic.
+
+    Memory is bounded: besides the current path, a transposition table of at most
+    table_size states remembers the cheapest depth each state was reached at in the
+    current iteration, so repeated visits at the same or greater depth are pruned.
+    States are re-expanded between iterations.
+    """
+    problem = compile_problem(problem)
+    matcher = RuleMatcher.from_problem(problem)
+    heuristic = length_heuristic(matcher)
+    budget = Budget(time_limit, max_nodes)
+    initial = problem.initial_string
+    expanded = generated = duplicates = peak_frontier = 0
+    solution, reason = None, "exhausted"
+
+    bound = heuristic(initial)
+    if initial == "":
+        solution, reason, bound = [], "solved", math.inf
+
+    while bound != math.inf:
+        next_bound = math.inf
+        path = [initial]
+        on_path = {initial}
+        rules = []
+        seen = {initial: 0}  # state -> cheapest depth in this iteration
+        stack = [matcher.successors(initial)]
+        expanded += 1
+
+        while stack:
+            reason = budget.spent(expanded) or "exhausted"
+            if reason != "exhausted":
+                break
+
+            step = next(stack[-1], None)
+            if step is None:
+                stack.pop()
+                on_path.discard(path.pop())
+                if rules:
+                    rules.pop()
+                continue
+            generated += 1
+
+            i, new_string = step
+            g = len(rules) + 1
+            if new_string in on_path or seen.get(new_string, math.inf) <= g:
+                duplicates += 1
+                continue
+            f = g + heuristic(new_string)
+            if f > bound:
+                next_bound = min(next_bound, f)
+                continue
+            if new_string == "":
+                solution, reason = rules + [i], "solved"
+                break
+            if new_string in seen or len(seen) < table_size:
+                seen[new_string] = g
+
+            path.append(new_string)
+            on_path.add(new_string)
+            rules.append(i)
+            stack.append(matcher.successors(new_string))
+            expanded += 1
+            peak_frontier = max(peak_frontier, len(stack))
+
+        if reason != "exhausted":
+            break
+        bound = next_bound
+
+    if stats is not None:
+        stats.finish(reason, budget, expanded, generated, duplicates, peak_frontier)
+    return solution
+
+
+def owner_of(state, workers):
+    # crc32 rather than hash() so every process agrees on the partition
+    return zlib.crc32(state.encode()) % workers
+
+
+def _send_buckets(peers, buckets):
+    for owner, conn in peers.items():
+        conn.send(buckets[owner])
+
+
+def _partition_worker(conn, peers, srcs, tgts, workers, index):
+    """
+    Owns one hash partition of the visited set for parallel_bfs.
+
+    States are interned locally; a global id is local_id * workers + index, so
+    parent links can point into any partition. peers maps every other worker's
+    index to a pipe, so children go straight to their owner.
+    """
+    matcher = RuleMatcher(srcs, tgts)
+    store = StateStore()
+    frontier = []
+
+    def admit(batches):
+        # Deduplicate incoming children against the owned visited slice
+        goal = None
+        for strings, parents, rules in batches:
+            for new_string, parent, rule in zip(strings, parents, rules):
+                if new_string not in store:
+                    sid = store.add(new_string, parent, rule)
+                    frontier.append(sid)
+                    if new_string == "":
+                        goal = sid * workers + index
+        return goal
+
+    while True:
+        command, payload = conn.recv()
+
+        if command == "layer":
+            # Generate the children of the owned frontier, bucketed by owner, until the deadline passes
+            buckets = [([], array("i"), array("i")) for _ in range(workers)]
+            expanded = 0
+            for sid in frontier:
+                if time.time() > payload:
+                    break
+                expanded += 1
+                gid = sid * workers + index
+                for i, new_string in matcher.successors(store.states[sid]):
+                    strings, parents, rules = buckets[owner_of(new_string, workers)]
+                    strings.append(new_string)
+                    parents.append(gid)
+                    rules.append(i)
+            generated = sum(len(strings) for strings, _, _ in buckets)
+            frontier = []
+
+            # Send from a thread while receiving, so two workers never block on each other's full pipe
+            sender = threading.Thread(target=_send_buckets, args=(peers, buckets))
+            sender.start()
+            incoming = [buckets[index]]
+            waiting = list(peers.values())
+            while waiting:
+                for ready in multiprocessing.connection.wait(waiting):
+                    incoming.append(ready.recv())
+                    waiting.remove(ready)
+            sender.join()
+            goal = admit(incoming)
+            conn.send((expanded, generated, len(frontier), goal))
+
+        elif command == "admit":
+            goal = admit(payload)
+            conn.send((0, 0, len(frontier), goal))
+
+        elif command == "trace":
+            sid = payload // workers
+            conn.send((store.parent[sid], store.rule[sid]))
+
+        else:
+            conn.close()
+            for peer in peers.values():
+                peer.close()
+            return
+
+
+def parallel_bfs(problem, time_limit=5, workers=None, stats=None, max_nodes=None):
+    """
+    Level-synchronous breadth-first search spread over worker processes.
+
+    The visited set is hash-partitioned so every state has exactly one owning
+    worker. Each layer, all workers expand their slice of the frontier in parallel,
+    send the children straight to their owners over a pipe per pair of workers,
+    and the owners keep the ones they have not seen, with a parent link into the
+    previous layer. Solutions have the same length as bfs. The budget is checked
+    between layers, so max_nodes may be overshot by up to one layer; workers
+    also stop expanding a layer once time_limit has passed.
+    """
+    problem = compile_problem(problem)
+    workers = workers or multiprocessing.cpu_count()
+    srcs, tgts = problem.srcs, problem.tgts
+    initial = problem.initial_string
+    budget = Budget(time_limit, max_nodes)
+    deadline = budget.start_time + time_limit
+    expanded = generated = admitted = 0
+    peak_frontier = 1
+    solution, reason = None, "exhausted"
+
+    if initial == "":
+        solution, reason = [], "solved"
+        workers = 0
+
+    peers = [{} for _ in range(workers)]
+    for i in range(workers):
+        for j in range(i + 1, workers):
+            peers[i][j], peers[j][i] = multiprocessing.Pipe()
+    conns, procs = [], []
+    for index in range(workers):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        proc = multiprocessing.Process(target=_partition_worker,
+                                       args=(child_conn, peers[index], srcs, tgts, workers, index), daemon=True)
+        proc.start()
+        conns.append(parent_conn)
+        procs.append(proc)
+    for peer in (peer for pipes in peers for peer in pipes.values()):
+        peer.close()
+    budget.watch(proc.pid for proc in procs)
+
+    try:
+        goal = None
+        frontier_size = 0
+        if conns:
+            root_owner = owner_of(initial, workers)
+            conns[root_owner].send(("admit", [([initial], array("i", [-1]), array("i", [-1]))]))
+            conns[root_owner].recv()
+            frontier_size = 1
+
+        while goal is None and frontier_size:
+            reason = budget.spent(expanded) or "exhausted"
+            if reason != "exhausted":
+                break
+
+            for conn in conns:
+                conn.send(("layer", deadline))
+            layer_start, layer_size, frontier_size = expanded, frontier_size, 0
+            for conn in conns:
+                done, children, size, found = conn.recv()
+                expanded += done
+                generated += children
+                frontier_size += size
+                if found is not None:
+                    goal = found
+            admitted += frontier_size
+            peak_frontier = max(peak_frontier, frontier_size)
+            # A layer cut at the deadline ends the search; a goal found in it is still
+            # a shortest one, as every earlier layer was complete
+            if goal is None and expanded - layer_start < layer_size:
+                reason = "time_limit"
+                break
+
+        if goal is not None:
+            # Follow the parent links back across partitions
+            solution, reason = [], "solved"
+            gid = goal
+            while True:
+                conn = conns[gid % workers]
+                conn.send(("trace", gid))
+                parent, rule = conn.recv()
+                if parent == -1:
+                    break
+                solution.append(rule)
+                gid = parent
+            solution.reverse()
+    finally:
+        for conn in conns:
+            conn.send(("stop", None))
+        for proc in procs:
+            proc.join()
+
+    if stats is not None:
+        stats.finish(reason, budget, expanded, generated, generated - admitted, peak_frontier)
+    return solution
+
+
+SOLVERS = {
+    "bfs": bfs,
+    "bidirectional": bidirectional_bfs,
+    "astar": astar,
+    "idastar": idastar,
+    "parallel": parallel_bfs,
+    "external": external_bfs,
+}
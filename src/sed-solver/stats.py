@@ -0,0 +1,117 @@
+import math
+import time
+import resource
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+# The clock and memory are read about once per CHECK_INTERVAL seconds, judged by the
+# expansion rate since the last read, and at least once per CHECK_EVERY expanded nodes
+CHECK_INTERVAL = 0.01
+CHECK_EVERY = 1024
+PAGE_KB = resource.getpagesize() // 1024
+
+
+def rss_kb(pid="self"):
+    """Current resident set size of a process in KiB, or None where /proc is unavailable"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * PAGE_KB
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+@dataclass
+class SearchStats:
+    """Cost record filled in by every solver; pass one in as stats= to collect it"""
+    nodes_expanded: int = 0
+    nodes_generated: int = 0
+    duplicates: int = 0
+    peak_frontier: int = 0
+    # Peak resident memory during the search over what was in use when it started. Cheap but
+    # approximate: memory an earlier search freed and the allocator kept is reused uncounted
+    memory_growth_kb: int = 0
+    # Exact peak of Python allocations over the start of the search (this process only, so not
+    # parallel workers); None unless tracemalloc is tracing
+    traced_peak_kb: Optional[int] = None
+    elapsed: float = 0.0
+    nodes_per_sec: float = 0.0
+    stop_reason: str = ""  # solved, exhausted, time_limit, node_limit, cached or certificate
+
+    def finish(self, reason, budget, expanded, generated, duplicates, peak_frontier):
+        self.stop_reason = reason
+        self.nodes_expanded = expanded
+        self.nodes_generated = generated
+        self.duplicates = duplicates
+        self.peak_frontier = peak_frontier
+        self.elapsed = time.time() - budget.start_time
+        self.nodes_per_sec = expanded / self.elapsed if self.elapsed > 0 else 0.0
+        self.memory_growth_kb = budget.memory_growth()
+        self.traced_peak_kb = budget.traced_peak()
+
+    def as_dict(self):
+        return asdict(self)
+
+
+class Budget:
+    """
+    Time and node budget of one search. Also samples the resident memory of the
+    process and of any worker processes it is told to watch at every check, so
+    a search's memory cost is measured from its own start rather than read off
+    the process-wide high-water mark, which an earlier search may have set.
+    """
+
+    def __init__(self, time_limit=5, max_nodes=None):
+        self.start_time = time.time()
+        self.time_limit = time_limit
+        self.max_nodes = math.inf if max_nodes is None else max_nodes
+        self.next_check = min(1, self.max_nodes)
+        self.last_check, self.last_expanded = self.start_time, 0
+        self.pids = []
+        self.start_rss = self.peak_rss = rss_kb()
+        self.traced_start = None
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self.traced_start = tracemalloc.get_traced_memory()[0]
+
+    def watch(self, pids):
+        """Counts the memory of these worker processes towards the search"""
+        self.pids = list(pids)
+        self.sample_memory()
+
+    def sample_memory(self):
+        if self.start_rss is None:
+            return
+        total = rss_kb() or 0
+        for pid in self.pids:
+            total += rss_kb(pid) or 0
+        self.peak_rss = max(self.peak_rss, total)
+
+    def memory_growth(self):
+        """Peak resident KiB over the start of the search; 0 where it cannot be measured"""
+        if self.start_rss is None:
+            return 0
+        self.sample_memory()
+        return self.peak_rss - self.start_rss
+
+    def traced_peak(self):
+        """Peak traced KiB over the start of the search, or None if tracemalloc was not tracing"""
+        if self.traced_start is None or not tracemalloc.is_tracing():
+            return None
+        return (tracemalloc.get_traced_memory()[1] - self.traced_start) // 1024
+
+    def spent(self, expanded):
+        """Returns the stop reason once the budget has run out, otherwise None"""
+        if expanded < self.next_check:
+            return None
+        self.sample_memory()
+        if expanded >= self.max_nodes:
+            return "node_limit"
+        now = time.time()
+        if now - self.start_time > self.time_limit:
+            return "time_limit"
+        # Slow nodes, or slow work between them such as merging layers, bring the next read closer
+        rate = (expanded - self.last_expanded) / max(now - self.last_check, 1e-6)
+        self.last_check, self.last_expanded = now, expanded
+        self.next_check = min(expanded + max(1, min(CHECK_EVERY, int(rate * CHECK_INTERVAL))), self.max_nodes)
+        return None
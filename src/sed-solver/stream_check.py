@@ -0,0 +1,89 @@
+import re
+
+from verifier import Verifier
+
+FENCE = "```"
+JSON_FENCE = "```json"
+SOLUTION_ARRAY = re.compile(r'"solution"\s*:\s*\[')
+# An index counts once its delimiter has arrived, so "1" is never taken for the start of "12"
+INDEX = re.compile(r"\s*(-?\d+)\s*([,\]])")
+PARTIAL_INDEX = re.compile(r"\s*-?\d*\s*")
+EMPTY_END = re.compile(r"\s*\]")
+
+
+class SolutionStream:
+    """
+    Checks an answer while it is being generated.
+
+    Text is fed in as it streams. Inside every ```json block, the indices of the
+    "solution" array are replayed step by step as soon as each one is complete,
+    the way batch_response_parser and Verifier would read the finished answer.
+    feed returns the step at which the partial solution stopped applying, or
+    None while it is still applicable. Text outside json blocks, such as
+    reasoning, is never checked, and an array holding anything but integers is
+    left for the parser to reject.
+    """
+
+    def __init__(self, verifier: Verifier):
+        self.verifier = verifier
+        self.text = ""
+        self.pos = 0
+        self.in_block = False
+        self.in_array = False
+        self.current = None
+        self.steps = []  # indices of the array being read, including a failing one
+        self.invalid_at = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        while self.invalid_at is None and self._advance():
+            pass
+        return self.invalid_at
+
+    def _advance(self):
+        """Consumes one token of the text if it is complete; False when more text is needed"""
+        text, pos = self.text, self.pos
+        if self.in_array:
+            m = INDEX.match(text, pos)
+            if m:
+                rule = int(m.group(1))
+                self.steps.append(rule)
+                self.current = self.verifier.step(self.current, rule)
+                if self.current is None:
+                    self.invalid_at = len(self.steps) - 1
+                self.in_array = m.group(2) == ","
+                self.pos = m.end()
+                return True
+            m = EMPTY_END.match(text, pos)
+            if m:
+                self.in_array = False
+                self.pos = m.end()
+                return True
+            if PARTIAL_INDEX.fullmatch(text, pos):
+                return False
+            self.in_array = False  # not a list of integers; the parser will report it
+            return True
+
+        if not self.in_block:
+            start = text.find(JSON_FENCE, pos)
+            if start == -1:
+                # Keep a possible fence split across chunks
+                self.pos = max(pos, len(text) - len(JSON_FENCE))
+                return False
+            self.in_block = True
+            self.pos = start + len(JSON_FENCE)
+            return True
+
+        end = text.find(FENCE, pos)
+        m = SOLUTION_ARRAY.search(text, pos, end if end != -1 else len(text))
+        if m:
+            self.in_array = True
+            self.current = self.verifier.initial
+            self.steps = []
+            self.pos = m.end()
+            return True
+        if end != -1:
+            self.in_block = False
+            self.pos = end + len(FENCE)
+            return True
+        return False
@@ -1,6 +1,9 @@
 import os
 from pathlib import Path
 import schema
+from verifier import Verifier
+from corpus import open_corpus
+from compiled import compile_record
 import json
 import logging
 
@@ -20,30 +23,46 @@ def read_problems_from_json(json_path=Path("../puzzles/puzzles.json")):
             logging.warning(f"Validation error while processing problem {problem_data.get('problem_id', 'unknown')}! skipping...", exc_info=True)
     return problems
 
-def read_problem_folder(path=Path("./data/problems")):
-    """Opens all problems at the folder and reads them using Pydantic"""
+def read_problem_folder(path=Path("./data/problems"), compiled=False):
+    """
+    Reads all problems from a folder or a packed corpus file and validates them using Pydantic.
+    With compiled=True they are returned as CompiledProblems, checked without building pydantic models.
+    """
     problems = {}
-    for file_path in path.iterdir():
-        problem_data = json.loads(file_path.read_text())
-        try:
-            problem = schema.Problem(**problem_data)
-            problems[problem.problem_id] = problem
-        except pydantic.ValidationError as e:
-            logging.warning(f"Validation error while processing {file_path}! skipping...", exc_info=True)
+    with open_corpus(path) as corpus:
+        for key, problem_data in corpus.items():
+            try:
+                problem = compile_record(problem_data) if compiled else schema.Problem(**problem_data)
+                problems[problem.problem_id] = problem
+            except (pydantic.ValidationError, ValueError, KeyError, TypeError) as e:
+                logging.warning(f"Validation error while processing {key} in {path}! skipping...", exc_info=True)
     return problems
 
 def read_solution_folder(path=Path("./data/solutions")):
-    """Opens all solutions at the folder and reads them using Pydantic"""
+    """Reads all solutions from a folder or a packed corpus file and validates them using Pydantic"""
     solutions = {}
-    for file_path in path.iterdir():
-        solution_data = json.loads(file_path.read_text())
-        try:
-            solution = schema.Solution(**solution_data)
-            solutions[solution.problem_id] = solution
-        except pydantic.ValidationError as e:
-            logging.warning(f"Validation error while processing {file_path}! skipping... ", exc_info=True)
+    with open_corpus(path) as corpus:
+        for key, solution_data in corpus.items():
+            try:
+                solution = schema.Solution(**solution_data)
+                solutions[solution.problem_id] = solution
+            except pydantic.ValidationError as e:
+                logging.warning(f"Validation error while processing {key} in {path}! skipping... ", exc_info=True)
     return solutions
 
+def read_metadata_folder(path=Path("./data/metadata")):
+    """Reads the difficulty profile of every puzzle from a folder or a packed corpus file"""
+    metadata = {}
+    if not Path(path).exists():
+        return metadata
+    with open_corpus(path) as corpus:
+        for key in corpus.ids():
+            try:
+                metadata[key] = corpus[key]["difficulty_profile"]
+            except (json.JSONDecodeError, TypeError, KeyError):
+                logging.warning(f"Malformed metadata for {key} in {path}! skipping...")
+    return metadata
+
 def write_problem_folder(problems, path=Path("./data/problems")):
     path.mkdir(exist_ok=True)
 
@@ -74,19 +93,15 @@ def validate_solutions(problems, solutions):
         problem = problems[problem_id]
         solution = solutions[problem_id]
 
-        transitions = problem.transitions
-        current = problem.initial_string
-
-        for step in solution.solution:
-            if step >= len(transitions):
-                logging.warning(f"Invalid step number {step} found! skipping problem...")
-                break
-            from_pattern = transitions[step].src
-            to_pattern = transitions[step].tgt
-            current = current.replace(from_pattern, to_pattern, 1)
-            logging.info(f"Pattern: {from_pattern} -> {to_pattern}, String: {current}")
+        verifier = Verifier.from_problem(problem)
+        verdict = verifier.check(solution.solution)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for step in verifier.steps(solution.solution):
+                logging.debug(f"Pattern: {step['src']} -> {step['tgt']}, String: {step['to']}")
+        if verdict.prefix < len(solution.solution):
+            logging.warning(f"Step {verdict.prefix} ({solution.solution[verdict.prefix]}) does not apply to {verdict.final!r}")
 
-        if current != '':
+        if not verdict.valid:
             logging.warning(f"Problem {problem_id} has an invalid solution!")
         else:
             logging.info(f"Problem {problem_id} has a valid solution!")
\ No newline at end of file
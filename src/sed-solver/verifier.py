@@ -0,0 +1,110 @@
+from typing import List, NamedTuple
+
+from compiled import compile_problem
+
+
+class Verdict(NamedTuple):
+    """Outcome of replaying one candidate solution"""
+    valid: bool  # the whole candidate applies and ends at the null string
+    prefix: int  # number of leading steps that apply
+    final: str  # string left after those steps
+
+
+class Verifier:
+    """
+    A puzzle compiled once for replaying candidate solutions.
+
+    Every step rewrites the leftmost occurrence of its transition's src (an empty
+    src matches at position 0). A candidate stops at the first step whose index
+    is out of range or whose src does not occur; the steps before it are its
+    valid prefix.
+    """
+
+    def __init__(self, initial, srcs, tgts):
+        self.initial = initial
+        self.srcs = list(srcs)
+        self.tgts = list(tgts)
+
+    @classmethod
+    def from_problem(cls, problem):
+        problem = compile_problem(problem)
+        return cls(problem.initial_string, problem.srcs, problem.tgts)
+
+    @classmethod
+    def from_dict(cls, problem):
+        """Compiles a problem given as parsed JSON rather than a schema.Problem"""
+        transitions = problem["transitions"]
+        return cls(problem["initial_string"], [t["src"] for t in transitions], [t["tgt"] for t in transitions])
+
+    def __len__(self):
+        return len(self.srcs)
+
+    def step(self, string, rule):
+        """Applies one transition, returning None if the index is out of range or src does not occur"""
+        if not 0 <= rule < len(self.srcs):
+            return None
+        src = self.srcs[rule]
+        pos = string.find(src) if src else 0
+        if pos == -1:
+            return None
+        return string[:pos] + self.tgts[rule] + string[pos + len(src):]
+
+    def check(self, solution) -> Verdict:
+        current = self.initial
+        for k, rule in enumerate(solution):
+            nxt = self.step(current, rule)
+            if nxt is None:
+                return Verdict(False, k, current)
+            current = nxt
+        return Verdict(current == "", len(solution), current)
+
+    def check_many(self, solutions) -> List[Verdict]:
+        """
+        Verdicts for many candidates at once, in input order.
+
+        Candidates are replayed in sorted order so each one resumes from the
+        longest prefix it shares with the previous candidate instead of
+        starting over from the initial string.
+        """
+        solutions = [tuple(solution) for solution in solutions]
+        verdicts = [None] * len(solutions)
+        path = [self.initial]  # path[k] is the string after the first k steps of prev
+        prev = ()
+        for index in sorted(range(len(solutions)), key=solutions.__getitem__):
+            solution = solutions[index]
+            shared = 0
+            limit = min(len(prev), len(solution), len(path) - 1)
+            while shared < limit and prev[shared] == solution[shared]:
+                shared += 1
+            del path[shared + 1:]
+
+            for rule in solution[shared:]:
+                nxt = self.step(path[-1], rule)
+                if nxt is None:
+                    break
+                path.append(nxt)
+            k = len(path) - 1
+            verdicts[index] = Verdict(k == len(solution) and path[-1] == "", k, path[-1])
+            prev = solution
+        return verdicts
+
+    def steps(self, solution):
+        """Every applied step of a candidate as a dict, for display; stops at the first failing step"""
+        steps = []
+        current = self.initial
+        for k, rule in enumerate(solution):
+            nxt = self.step(current, rule)
+            if nxt is None:
+                break
+            src = self.srcs[rule]
+            steps.append({
+                "step": k,
+                "from": current,
+                "to": nxt,
+                "transition": rule,
+                "src": src,
+                "tgt": self.tgts[rule],
+                "pos": current.find(src) if src else 0,
+            })
+            current = nxt
+        return steps
@@ -4,6 +4,7 @@ import os
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from schema import Problem, Solution
+from verifier import Verifier
 from graphviz import Digraph
 
 
@@ -17,35 +18,14 @@ def visualize_solution(problem: Problem, solution: Solution, output_dir="./visua
 
 
 def generate_steps(problem: Problem, solution: Solution):
-    steps = []
-    current = problem.initial_string
-
-    for idx, t_idx in enumerate(solution.solution):
-        t = problem.transitions[t_idx]
-        src, tgt = t.src, t.tgt
-        pos = current.find(src) if src else 0
-
-        if pos == -1:
-            raise ValueError(f"Cannot apply {src}->{tgt} on '{current}'")
-
-        nxt = current[:pos] + tgt + current[pos + len(src):]
-
-        steps.append({
-            "step": idx,
-            "from": current,
-            "to": nxt,
-            "transition": t_idx,
-            "src": src,
-            "tgt": tgt,
-            "pos": pos
-        })
-
-        current = nxt
-
-    if current != "":
+    verifier = Verifier.from_problem(problem)
+    verdict = verifier.check(solution.solution)
+    if verdict.prefix < len(solution.solution):
+        t_idx = solution.solution[verdict.prefix]
+        raise ValueError(f"Cannot apply transition {t_idx} on '{verdict.final}'")
+    if not verdict.valid:
         raise ValueError("Solution does not reach null string")
-
-    return steps
+    return verifier.steps(solution.solution)
 
 def save_graph_visualization(problem, solution, steps, output_dir):
     try:
@@ -97,23 +77,7 @@ def animate_solution(problem: Problem, solution: Solution, output_dir="./visuali
     os.makedirs(output_dir, exist_ok=True)
 
     # Prepare steps
-    steps = []
-    current = problem.initial_string
-    for idx, t_idx in enumerate(solution.solution):
-        t = problem.transitions[t_idx]
-        src, tgt = t.src, t.tgt
-        pos = current.find(src) if src else 0
-        if pos == -1:
-            raise ValueError(f"Cannot apply {src}->{tgt} on '{current}'")
-        nxt = current[:pos] + tgt + current[pos+len(src):]
-        steps.append({
-            "from": current,
-            "to": nxt,
-            "pos": pos,
-            "src": src,
-            "tgt": tgt
-        })
-        current = nxt
+    steps = generate_steps(problem, solution)
 
     # Matplotlib setup
     fig, ax = plt.subplots(figsize=(12, 2))